@@ -0,0 +1,163 @@
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from config import CALC_PATH, TALYS_INP_FILE_NAME, N
+from run_cache import load_run_cache, save_run_cache, register_run, run_key
+from talys_jobs import run_status
+
+
+## Backfill of the run cache from existing run directories, e.g. the
+## <projectile>-<element><mass>_chisquared_<i> trees written by calc.main
+## before the cache existed. Every talys.inp is parsed back into a job, so
+## the input hash is the one the scheduler computes, whatever the spacing of
+## the old files. Runs with the same input are reported as duplicates; the
+## cached (or first) directory is kept.
+
+RUN_DIRECTORY_PATTERN = re.compile(r"^[a-z]-[A-Z][a-z]?\d+_chisquared_\d+$")
+
+
+def find_run_directories(root=None):
+    ## run directories anywhere under root, without speculative copies,
+    ## shallowest first (the one kept among duplicates). CALC_PATH/compare
+    ## holds runs of other TALYS binaries (compare_talys), which would be
+    ## registered for the wrong one.
+    root = root or CALC_PATH
+    directories = []
+    for directory, subdirectories, _ in os.walk(root):
+        for name in subdirectories:
+            if RUN_DIRECTORY_PATTERN.match(name):
+                directories.append(os.path.join(directory, name))
+        subdirectories[:] = [
+            name
+            for name in subdirectories
+            if not RUN_DIRECTORY_PATTERN.match(name)
+            and os.path.join(directory, name) != os.path.join(CALC_PATH, "compare")
+        ]
+
+    return sorted(directories, key=lambda d: (d.count(os.sep), d))
+
+
+def parse_talys_inp(input_file):
+    ## (input, energy_range, parameters) as build_talys_jobs writes them
+    input = {}
+    energy_range = None
+    parameters = {}
+    with open(input_file) as f:
+        for line in f:
+            words = line.split()
+            if not words or words[0].startswith("#"):
+                continue
+            keyword, value = " ".join(words[:-1]), words[-1]
+
+            if keyword in ("projectile", "element", "mass"):
+                input[keyword] = value
+            elif words[0] == "energy":
+                energy_range = " ".join(words[1:])
+            elif keyword == "ldmodel":
+                parameters[keyword] = int(value)
+            elif keyword == "colenhance":
+                parameters[keyword] = value
+            elif keyword != "fit":
+                parameters[keyword] = float(value)
+
+    return input, energy_range, parameters
+
+
+def count_residual_points(calc_directory):
+    ## {rp file: number of data lines}
+    points = {}
+    for name in os.listdir(calc_directory):
+        if not name.startswith("rp"):
+            continue
+        with open(os.path.join(calc_directory, name)) as f:
+            points[name] = sum(
+                1 for line in f if line.strip() and not line.lstrip().startswith("#")
+            )
+
+    return points
+
+
+def read_run_directory(calc_directory, talys_path=None):
+    ## the job of a finished run, or the reason it cannot be imported
+    input_file = os.path.join(calc_directory, TALYS_INP_FILE_NAME)
+    if not os.path.exists(input_file):
+        return None, "no talys.inp"
+    if run_status({"calc_directory": calc_directory}) != "done":
+        return None, "no rp* files"
+
+    try:
+        input, energy_range, parameters = parse_talys_inp(input_file)
+    except ValueError as e:
+        return None, f"unreadable talys.inp ({e})"
+
+    points = count_residual_points(calc_directory)
+    if not any(points.values()):
+        return None, "empty rp* files"
+
+    job = {
+        "name": os.path.basename(calc_directory),
+        "input": input,
+        "parameters": parameters,
+        "energy_range": energy_range,
+        "calc_directory": calc_directory,
+        "input_file": input_file,
+    }
+    if talys_path is not None:
+        job["talys_path"] = talys_path
+    job["key"] = run_key(job)
+
+    return job, None
+
+
+def backfill_run_cache(root=None, talys_path=None, n_workers=N):
+    ## talys_path: installation that produced the runs (default TALYS_PATH)
+    directories = find_run_directories(root)
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        parsed = list(
+            executor.map(lambda d: read_run_directory(d, talys_path), directories)
+        )
+
+    run_cache = load_run_cache()
+    by_key = {}
+    skipped = {}
+    for calc_directory, (job, reason) in zip(directories, parsed):
+        if job is None:
+            skipped[calc_directory] = reason
+            continue
+        by_key.setdefault(job["key"], []).append(job)
+
+    imported = 0
+    known = 0
+    duplicates = {}
+    for key, jobs in by_key.items():
+        ## keep the directory the cache already points to
+        cached = run_cache.get(key, {}).get("calc_directory")
+        if cached is not None and run_status({"calc_directory": cached}) == "done":
+            known += 1
+        else:
+            register_run(run_cache, jobs[0])
+            cached = jobs[0]["calc_directory"]
+            imported += 1
+
+        others = [job["calc_directory"] for job in jobs if job["calc_directory"] != cached]
+        if others:
+            duplicates[cached] = others
+
+    save_run_cache(run_cache)
+
+    for calc_directory, reason in skipped.items():
+        print(f"Skipped {calc_directory}: {reason}")
+    for calc_directory, others in duplicates.items():
+        print(f"{calc_directory} has the same input as: {', '.join(others)}")
+    print(
+        f"{len(directories)} run directories: {imported} imported, {known} already "
+        f"cached, {sum(len(o) for o in duplicates.values())} duplicates, "
+        f"{len(skipped)} skipped"
+    )
+
+    return {"imported": imported, "known": known, "duplicates": duplicates, "skipped": skipped}
+
+
+if __name__ == "__main__":
+    backfill_run_cache()
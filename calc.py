@@ -3,12 +3,11 @@ import json
 import numpy as np
 
 from config import (
-    TALYS_INP_FILE_NAME,
-    IAEA_MEDICAL_LIST,
     CALC_PATH,
     ENERGY_RANGE_MIN,
     ENERGY_RANGE_MAX,
     ENERGY_STEP,
+    MC_REPLICAS,
     N,
 )
 from plotting import (
@@ -21,7 +20,6 @@ from plotting import (
     generate_combined_chi_squared_gnuplot_script,
 )
 from utils import (
-    split_by_number,
     clean_data_file,
     genenerate_six_digit_code
 )
@@ -30,135 +28,23 @@ from talys_modules import (
     run_talys,
     search_residual_output,
 )
+from talys_jobs import (
+    frange,
+    get_IAEA_medical_isotope_nuclides,
+    build_talys_jobs,
+)
+from scheduler import run_jobs
+from run_cache import restore_cached_runs
+from chi_squared import update_chi_squared, monte_carlo_ranking
+from xs_cube import build_cross_section_cube
 from score_table import get_score_tables
 
 
-parameter_check_cases = [
-    {"ldmodel": 1, "colenhance": "n"},
-    {"ldmodel": 1, "colenhance": "y"},
-    {"ldmodel": 2, "colenhance": "n"},
-    {"ldmodel": 2, "colenhance": "y"},
-    {"ldmodel": 5, "colenhance": "n"},
-]
-
-
-def interpolate_simulation(energy_exp, simulation_data):
-    """Linearly interpolation"""
-    for i in range(1, len(simulation_data)):
-        e1, cs1 = simulation_data[i - 1]
-        e2, cs2 = simulation_data[i]
-
-        if e1 <= energy_exp <= e2:
-            return cs1 + (cs2 - cs1) * (energy_exp - e1) / (e2 - e1)
-    return None  # If outside the range of simulation data
-
-
-def calculate_combined_chi_squared(
-    output_directory, cleaned_external_files, simulation_data, ERROR_THRESHOLD, code
-):
-    chi_squared = 0.0
-    dataset_chi_squared_list = []
-    valid_datasets = 0.0
-    output_file_path = os.path.join(
-        output_directory, f"chi_squared_values_{code}.txt"
-    )
-
-    with open(output_file_path, "w") as output_file:
-        output_file.write("#File Name\tChi-Squared Value\n")
-        for cleaned_external_file in cleaned_external_files:
-            experimental_data = load_experimental_data(
-                cleaned_external_file
-            )  # Load the external file
-            valid_points = 0.0
-            chi_squared_for_dataset = 0.0  # Initialize chi-squared for this dataset
-
-            print(f"\nProcessing file: {cleaned_external_file}")
-
-            for exp_point in experimental_data:
-                try:
-                    # Try to unpack assuming exp_point is iterable
-                    energy_exp, _, cross_section_exp, delta_cross_exp, _ = exp_point
-                except TypeError:
-                    print(
-                        f"Skipping invalid data point in file {cleaned_external_file}: {exp_point}"
-                    )
-                    continue  # Skip to the next point if unpacking fails
-
-                if delta_cross_exp < ERROR_THRESHOLD * cross_section_exp:
-                    print(
-                        f"Skipping data point due to small delta_cross_exp (< {ERROR_THRESHOLD * 100}% of cross_section) for energy {energy_exp}"
-                    )
-                    continue
-
-                sim_cross_section = interpolate_simulation(energy_exp, simulation_data)
-
-                if sim_cross_section is not None and delta_cross_exp > 0:
-                    chi_squared_for_dataset += (
-                        (cross_section_exp - sim_cross_section) ** 2
-                    ) / (delta_cross_exp**2)
-                    valid_points += 1  # Count this point as valid
-                else:
-                    print(
-                        f"Skipping data point due to invalid delta_cross_exp or no simulation match for energy {energy_exp}"
-                    )
-
-            if valid_points > 0:
-                normalized_chi_squared = chi_squared_for_dataset / valid_points
-                chi_squared += normalized_chi_squared
-                dataset_chi_squared_list.append(normalized_chi_squared)
-                valid_datasets += 1
-                output_file.write(
-                    f"{cleaned_external_file}\t{normalized_chi_squared:.6f}\n"
-                )
-                print(f"Valid points for {cleaned_external_file}: {valid_points}")
-                print(
-                    f"Normalized chi-squared for dataset {cleaned_external_file}: {normalized_chi_squared:.6f}"
-                )
-            else:
-                print(
-                    f"No valid points in dataset {cleaned_external_file}, skipping normalization."
-                )
-
-    if valid_datasets > 0:
-        chi_squared /= valid_datasets
-    print("\nChi-squared values for each dataset:", dataset_chi_squared_list)
-    print(f"Number of valid datasets: {valid_datasets}")
-    return chi_squared
-
-
-
-
-
 def load_simulation_data(file_path):
     return np.loadtxt(file_path, usecols=(0, 1))
 
 
 
-def frange(start, stop, step):
-    while start <= stop:
-        yield start
-        start += step
-
-
-def get_IAEA_medical_isotope_nuclides() -> list:
-    # format
-    # Br000	p	X	Se072
-    medical_reactions = []
-
-    f = open(IAEA_MEDICAL_LIST, "r")
-
-    for line in f.readlines():
-        l = line.split()
-        projectile = l[1]
-        target = split_by_number( l[0] )
-        residual = split_by_number( l[3] )
-
-        medical_reactions += [ {"projectile": projectile, "element": target[0], "mass": target[1], "target": target, "residual": residual} ]
-
-    return medical_reactions
-
-
-
 def main():
     ## get nuclides to calculate
     medical_isotope_reactions = get_IAEA_medical_isotope_nuclides()
@@ -166,6 +52,29 @@ def main():
     ## get score table in Python dictionary
     score_dict = get_score_tables()
 
+    ## run TALYS for all reactions and cases, longest runs first; runs with
+    ## the same input computed before are reused
+    jobs = build_talys_jobs(medical_isotope_reactions)
+    to_run, _ = restore_cached_runs(jobs)
+    if to_run:
+        run_jobs(to_run, N)
+
+    ## collect residual cross sections of all runs into one array
+    cube = build_cross_section_cube(
+        medical_isotope_reactions,
+        jobs,
+        list(frange(ENERGY_RANGE_MIN, ENERGY_RANGE_MAX, ENERGY_STEP)),
+    )
+
+    ## chi-squared of every residual and case, only where inputs changed
+    update_chi_squared(medical_isotope_reactions, jobs, score_dict, cube=cube)
+
+    ## how stable is the best case against the experimental uncertainties
+    if MC_REPLICAS:
+        monte_carlo_ranking(
+            medical_isotope_reactions, jobs, score_dict, MC_REPLICAS, cube=cube
+        )
+
     for input in medical_isotope_reactions:
         print(input)
         projectile = input["projectile"]
@@ -179,21 +88,6 @@ def main():
         )
         os.makedirs(output_directory, exist_ok=True)
 
-        energy_range = f"{ENERGY_RANGE_MIN} {ENERGY_RANGE_MAX} {ENERGY_STEP}"
-
-        for i in range(len(parameter_check_cases)): 
-            calc_directory = os.path.join(
-                CALC_PATH, f"{projectile}-{element}{mass}_chisquared_{i}"
-            )  # CALC_PATH
-            os.makedirs(calc_directory, exist_ok=True)
-
-            ## create input
-            input_file = os.path.join(calc_directory, TALYS_INP_FILE_NAME)
-            create_talys_inp(input_file, input, energy_range, parameter_check_cases[i])
-
-            # actual run
-            run_talys(input_file, calc_directory)
-
 
         # cleaned_external_files = [[] for _ in range(3)]
         # cleaned_all_external_files = [[] for _ in range(3)]
@@ -0,0 +1,240 @@
+import os
+
+from config import (
+    CALC_PATH,
+    IAEA_MEDICAL_LIST,
+    ENERGY_RANGE_MIN,
+    ENERGY_RANGE_MAX,
+    ENERGY_STEP,
+    MC_REPLICAS,
+    N,
+)
+from talys_jobs import (
+    get_IAEA_medical_isotope_nuclides,
+    build_talys_jobs,
+    parameter_check_cases,
+    frange,
+    reaction_name,
+    residual_name,
+    select_reactions,
+    select_reaction,
+)
+from chi_squared import (
+    load_chi_squared_store,
+    load_dataset_arrays,
+    reaction_external_files,
+    update_chi_squared,
+    monte_carlo_ranking,
+)
+from global_selection import select_global_parameters
+from plotting import generate_combined_gnuplot_script, render_plots
+from job_queue import interactive_job, submit_job, scheduler_running
+from refine import refine_jobs
+from run_cache import restore_cached_runs
+from scheduler import run_jobs, plan_jobs
+from score_table import get_score_tables
+from xs_cube import (
+    cube_path,
+    residual_output_path,
+    build_cross_section_cube,
+    update_cross_section_cube,
+    open_cross_section_cube,
+    cube_simulation_data,
+)
+
+
+class Campaign:
+    ## Programmatic access to a campaign for notebooks and services. The
+    ## reaction list, score tables, EXFOR index, chi-squared store and cross
+    ## section cube are loaded once and reused by every call. Reactions are
+    ## selected as "p-Cd111" (all residuals), "p-Cd111 In111" or lists of
+    ## those; None selects the whole list. Run directories and EXFOR tables
+    ## are the CALC_PATH and EXFOR_TABLES_PATH of config.py.
+
+    def __init__(
+        self,
+        iaea_list=IAEA_MEDICAL_LIST,
+        cases=None,
+        energy_range=None,
+        n_workers=N,
+        score_dict=None,
+    ):
+        self.reactions = get_IAEA_medical_isotope_nuclides(iaea_list)
+        self.cases = cases or parameter_check_cases
+        self.energy_range = (
+            energy_range or f"{ENERGY_RANGE_MIN} {ENERGY_RANGE_MAX} {ENERGY_STEP}"
+        )
+        self.n_workers = n_workers
+        self.score_dict = score_dict if score_dict is not None else get_score_tables()
+        self.chi_squared = load_chi_squared_store()
+
+        self.exfor_index = {}
+        self._datasets = {}
+        self._cube = None
+
+    def reload_scores(self):
+        ## after score table changes: the EXFOR selection depends on them
+        self.score_dict = get_score_tables()
+        self.exfor_index.clear()
+        self._datasets.clear()
+
+    def select(self, reactions=None):
+        return select_reactions(self.reactions, reactions)
+
+    def jobs(self, reactions=None):
+        return build_talys_jobs(self.select(reactions), self.cases, self.energy_range)
+
+    def external_files(self, input):
+        ## (all, weight 1) EXFOR tables
+        return reaction_external_files(input, self.score_dict, self.exfor_index)
+
+    def datasets(self, input):
+        key = f"{reaction_name(input)} {residual_name(input)}"
+        if key not in self._datasets:
+            self._datasets[key] = load_dataset_arrays(self.external_files(input)[1])
+        return self._datasets[key]
+
+    @property
+    def cube(self):
+        ## (cube, metadata) of all runs, memory-mapped
+        if self._cube is None:
+            if os.path.exists(cube_path()):
+                self._cube = open_cross_section_cube()
+            else:
+                self.build_cube()
+        return self._cube
+
+    def build_cube(self):
+        emin, emax, estep = [float(e) for e in self.energy_range.split()]
+        build_cross_section_cube(self.reactions, self.jobs(), list(frange(emin, emax, estep)))
+        self._cube = open_cross_section_cube()
+
+    def simulation(self, reaction, residual, case):
+        ## (energy, cross section) of one run from the cube
+        cube, metadata = self.cube
+        return cube_simulation_data(cube, metadata, reaction, residual, case)
+
+    def plan(self, reactions=None, force=False):
+        ## dry run: (jobs to launch, estimated cost)
+        return plan_jobs(self.jobs(reactions), self.n_workers, force)
+
+    def run(self, reactions=None, skip_done=True):
+        jobs = self.jobs(reactions)
+        restored = []
+        if skip_done:
+            ## runs with the same input elsewhere are copied, not recomputed
+            jobs, restored = restore_cached_runs(jobs)
+        if not jobs and not restored:
+            return {}
+        results = run_jobs(jobs, self.n_workers) if jobs else {}
+
+        if os.path.exists(cube_path()):
+            update_cross_section_cube(jobs + restored)
+            self._cube = open_cross_section_cube()
+        else:
+            self.build_cube()
+
+        return results
+
+    def submit(self, reaction, parameters):
+        ## one run ahead of a campaign running in another process (interactive
+        ## lane), or run now if no scheduler is running
+        ## ValueError unless reaction selects exactly one residual
+        job = interactive_job(
+            select_reaction(self.reactions, reaction), parameters, self.energy_range
+        )
+        if scheduler_running():
+            submit_job(job)
+            return None
+        return run_jobs([job], self.n_workers)
+
+    def refine(self, reactions=None):
+        ## adaptive energy grid: the jobs with calc_directory set to the merged
+        ## rp* files, e.g. for update_chi_squared
+        return refine_jobs(self.select(reactions), self.jobs(reactions), self.n_workers)
+
+    def score(self, reactions=None):
+        ## chi-squared of every selected reaction, residual and case,
+        ## recomputed only where TALYS output or EXFOR selection changed
+        selected = self.select(reactions)
+        self.chi_squared = update_chi_squared(
+            selected,
+            self.jobs(reactions),
+            self.score_dict,
+            self.exfor_index,
+            self.cube,
+            self.n_workers,
+        )
+
+        keys = {f"{reaction_name(input)} {residual_name(input)}" for input in selected}
+        return {
+            key: value["chi_squared"]
+            for key, value in self.chi_squared.items()
+            if f"{value['reaction']} {value['residual']}" in keys
+        }
+
+    def rank(self, reactions=None):
+        ## {"<reaction> <residual>": [(case, chi-squared), ...] best first},
+        ## reactions without experimental data are left out
+        ranking = {}
+        for input in self.select(reactions):
+            key = f"{reaction_name(input)} {residual_name(input)}"
+            values = [
+                (case, self.chi_squared[f"{key} {case}"]["chi_squared"])
+                for case in range(len(self.cases))
+                if self.chi_squared.get(f"{key} {case}", {}).get("n_datasets")
+            ]
+            if not values:
+                continue
+            ranking[key] = sorted(values, key=lambda value: value[1])
+
+        return ranking
+
+    def select_global(self):
+        ## best case per Z/A region over all stored chi-squared values,
+        ## with the leave-one-out check
+        return select_global_parameters(self.chi_squared, len(self.cases))
+
+    def best_case_probability(self, reactions=None, n_replicas=MC_REPLICAS):
+        ## only the ranking of the whole campaign is written to MC_RANKING_FILE
+        return monte_carlo_ranking(
+            self.select(reactions),
+            self.jobs(reactions),
+            self.score_dict,
+            n_replicas,
+            self.exfor_index,
+            save=reactions is None,
+            cube=self.cube,
+            n_workers=self.n_workers,
+        )
+
+    def plot(self, reactions=None, force=False):
+        ## TALYS cases against the EXFOR data, one PNG per reaction and residual;
+        ## plots whose script and data are unchanged are not rendered again
+        plot_directory = os.path.join(CALC_PATH, "plots")
+        os.makedirs(plot_directory, exist_ok=True)
+
+        jobs = self.jobs(reactions)
+        plot_files = []
+        gnuplot_scripts = []
+        for input in self.select(reactions):
+            residual = residual_name(input)
+            output_files = [
+                residual_output_path(job["calc_directory"], residual)
+                for job in jobs
+                if reaction_name(job["input"]) == reaction_name(input)
+            ]
+            output_files = [f for f in output_files if os.path.exists(f)]
+            all_external_files, external_files = self.external_files(input)
+
+            plot_file = os.path.join(
+                plot_directory, f"{reaction_name(input)}_{residual}.png"
+            )
+            gnuplot_script = generate_combined_gnuplot_script(
+                output_files, external_files, all_external_files, plot_file
+            )
+            gnuplot_scripts.append((gnuplot_script, plot_file.replace(".png", ".gp")))
+            plot_files.append(plot_file)
+
+        render_plots(gnuplot_scripts, self.n_workers, force)
+        return plot_files
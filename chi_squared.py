@@ -0,0 +1,543 @@
+import os
+import json
+import hashlib
+
+import numpy as np
+
+from config import (
+    CALC_PATH,
+    EXFOR_TABLES_PATH,
+    ERROR_THRESHOLD,
+    NORMALIZATION_UNCERTAINTY,
+    CHI2_STORE_FILE,
+    MC_REPLICAS,
+    MC_RANKING_FILE,
+    N,
+)
+from plotting import load_experimental_data, select_external_files
+from exfor_table import extract_code_from_filename
+from shared_exfor import dataset_pool, shared_task
+from xs_cube import (
+    reaction_name,
+    residual_name,
+    residual_output_path,
+    load_residual_output,
+    cube_slice,
+)
+
+
+def interpolate_simulation(energy_exp, simulation_data):
+    """Linearly interpolation"""
+    for i in range(1, len(simulation_data)):
+        e1, cs1 = simulation_data[i - 1]
+        e2, cs2 = simulation_data[i]
+
+        if e1 <= energy_exp <= e2:
+            return cs1 + (cs2 - cs1) * (energy_exp - e1) / (e2 - e1)
+    return None  # If outside the range of simulation data
+
+
+def calculate_combined_chi_squared(
+    output_directory, cleaned_external_files, simulation_data, ERROR_THRESHOLD, code
+):
+    chi_squared = 0.0
+    dataset_chi_squared_list = []
+    valid_datasets = 0.0
+    output_file_path = os.path.join(
+        output_directory, f"chi_squared_values_{code}.txt"
+    )
+
+    with open(output_file_path, "w") as output_file:
+        output_file.write("#File Name\tChi-Squared Value\n")
+        for cleaned_external_file in cleaned_external_files:
+            experimental_data = load_experimental_data(
+                cleaned_external_file
+            )  # Load the external file
+            valid_points = 0.0
+            chi_squared_for_dataset = 0.0  # Initialize chi-squared for this dataset
+
+            print(f"\nProcessing file: {cleaned_external_file}")
+
+            for exp_point in experimental_data:
+                try:
+                    # Try to unpack assuming exp_point is iterable
+                    energy_exp, _, cross_section_exp, delta_cross_exp, _ = exp_point
+                except TypeError:
+                    print(
+                        f"Skipping invalid data point in file {cleaned_external_file}: {exp_point}"
+                    )
+                    continue  # Skip to the next point if unpacking fails
+
+                if delta_cross_exp < ERROR_THRESHOLD * cross_section_exp:
+                    print(
+                        f"Skipping data point due to small delta_cross_exp (< {ERROR_THRESHOLD * 100}% of cross_section) for energy {energy_exp}"
+                    )
+                    continue
+
+                sim_cross_section = interpolate_simulation(energy_exp, simulation_data)
+
+                if sim_cross_section is not None and delta_cross_exp > 0:
+                    chi_squared_for_dataset += (
+                        (cross_section_exp - sim_cross_section) ** 2
+                    ) / (delta_cross_exp**2)
+                    valid_points += 1  # Count this point as valid
+                else:
+                    print(
+                        f"Skipping data point due to invalid delta_cross_exp or no simulation match for energy {energy_exp}"
+                    )
+
+            if valid_points > 0:
+                normalized_chi_squared = chi_squared_for_dataset / valid_points
+                chi_squared += normalized_chi_squared
+                dataset_chi_squared_list.append(normalized_chi_squared)
+                valid_datasets += 1
+                output_file.write(
+                    f"{cleaned_external_file}\t{normalized_chi_squared:.6f}\n"
+                )
+                print(f"Valid points for {cleaned_external_file}: {valid_points}")
+                print(
+                    f"Normalized chi-squared for dataset {cleaned_external_file}: {normalized_chi_squared:.6f}"
+                )
+            else:
+                print(
+                    f"No valid points in dataset {cleaned_external_file}, skipping normalization."
+                )
+
+    if valid_datasets > 0:
+        chi_squared /= valid_datasets
+    print("\nChi-squared values for each dataset:", dataset_chi_squared_list)
+    print(f"Number of valid datasets: {valid_datasets}")
+    return chi_squared
+
+
+## Incremental chi-squared
+## Every stored value keeps the fingerprints (SHA-256 of the content) of what
+## it was computed from: the TALYS cross section (its slice of the cross
+## section cube, or the rp file without a cube), the selected EXFOR subentries
+## (which change with the score tables) and their table files, and
+## ERROR_THRESHOLD. Only values whose dependencies changed are recomputed, so
+## a rerun writing the same output recomputes nothing. Nothing is written to
+## the run directories.
+
+## fingerprints by (path, size, mtime)
+_fingerprints = {}
+
+
+def chi_squared_store_path():
+    return os.path.join(CALC_PATH, CHI2_STORE_FILE)
+
+
+def load_chi_squared_store():
+    path = chi_squared_store_path()
+    if not os.path.exists(path):
+        return {}
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_chi_squared_store(store):
+    os.makedirs(CALC_PATH, exist_ok=True)
+    with open(chi_squared_store_path(), "w") as f:
+        json.dump(store, f, indent=1)
+
+
+def file_fingerprint(path):
+    ## first 16 hex digits of the SHA-256 of the file
+    st = os.stat(path)
+    key = (path, st.st_size, st.st_mtime_ns)
+
+    if key not in _fingerprints:
+        with open(path, "rb") as f:
+            _fingerprints[key] = hashlib.sha256(f.read()).hexdigest()[:16]
+
+    return _fingerprints[key]
+
+
+def array_fingerprint(data):
+    return hashlib.sha256(np.ascontiguousarray(data).tobytes()).hexdigest()[:16]
+
+
+def simulation_output(job, input, cube=None):
+    ## (fingerprint, simulation) of the run's residual cross section, read from
+    ## cube = (cube, metadata) if given; without a cube the rp file is loaded
+    ## by load_simulation only when needed. None if the run has no output.
+    residual = residual_name(input)
+    if cube is not None:
+        simulation = cube_slice(*cube, reaction_name(input), residual, job["case"])
+        return None if simulation is None else (array_fingerprint(simulation), simulation)
+
+    rp_file = residual_output_path(job["calc_directory"], residual)
+    if not os.path.exists(rp_file):
+        return None
+    return file_fingerprint(rp_file), None
+
+
+def load_simulation(job, input, simulation):
+    if simulation is not None:
+        return simulation
+    return load_residual_output(job["calc_directory"], residual_name(input))
+
+
+def exfortables_directory(input):
+    ## e.g. EXFOR_TABLES_PATH/p/Cd111/residual/049111
+    return os.path.join(
+        EXFOR_TABLES_PATH,
+        input["projectile"],
+        input["target_nuclide"].exfor_name,
+        "residual",
+        input["residual_nuclide"].code,
+    )
+
+
+def reaction_external_files(input, score_dict, exfor_index=None):
+    ## (all, weight 1) EXFOR tables of the reaction and residual; exfor_index
+    ## is a dict kept by the caller to avoid repeating the directory scans
+    key = f"{reaction_name(input)} {residual_name(input)}"
+    if exfor_index is not None and key in exfor_index:
+        return exfor_index[key]
+
+    external_files = select_external_files(exfortables_directory(input), score_dict)
+    if exfor_index is not None:
+        exfor_index[key] = external_files
+    return external_files
+
+
+def chi_squared_key(input, case):
+    return f"{reaction_name(input)} {residual_name(input)} {case}"
+
+
+def update_chi_squared(
+    medical_isotope_reactions, jobs, score_dict, exfor_index=None, cube=None, n_workers=N
+):
+    ## cube: (cube, metadata) of open_cross_section_cube to read the TALYS
+    ## cross sections from instead of the run directories
+    ## The stale values are scored in a process pool sharing the datasets
+    ## (shared_exfor), one task per residual with all its stale cases.
+    store = load_chi_squared_store()
+
+    jobs_by_reaction = {}
+    for job in jobs:
+        jobs_by_reaction.setdefault(reaction_name(job["input"]), []).append(job)
+
+    unchanged = 0
+    ## {"<reaction> <residual>": (input, EXFOR files, stale values)}
+    pending = {}
+    for input in medical_isotope_reactions:
+        _, external_files = reaction_external_files(input, score_dict, exfor_index)
+        datasets = {
+            extract_code_from_filename(f): file_fingerprint(f) for f in external_files
+        }
+
+        stale = []
+        for job in jobs_by_reaction.get(reaction_name(input), []):
+            output = simulation_output(job, input, cube)
+            if output is None:
+                continue
+
+            key = chi_squared_key(input, job["case"])
+            dependencies = {
+                "talys": output[0],
+                "exfor": datasets,
+                "error_threshold": ERROR_THRESHOLD,
+                "normalization_uncertainty": NORMALIZATION_UNCERTAINTY,
+            }
+            if key in store and store[key]["dependencies"] == dependencies:
+                unchanged += 1
+                continue
+            stale.append((key, job, dependencies, output[1]))
+
+        if stale:
+            pending[f"{reaction_name(input)} {residual_name(input)}"] = (
+                input,
+                external_files,
+                stale,
+            )
+
+    recomputed = 0
+    if pending:
+        ## the EXFOR files are read (and whitened) once for all cases
+        datasets = {
+            key: load_dataset_arrays(external_files)
+            for key, (_, external_files, _) in pending.items()
+        }
+        with dataset_pool(datasets, n_workers) as (executor, name):
+            futures = {}
+            for key, (input, _, stale) in pending.items():
+                simulations = [
+                    load_simulation(job, input, simulation)
+                    for _, job, _, simulation in stale
+                ]
+                if NORMALIZATION_UNCERTAINTY is None:
+                    futures[key] = executor.submit(
+                        shared_task, nominal_chi_squared, name, key, simulations
+                    )
+                else:
+                    futures[key] = executor.submit(
+                        shared_task,
+                        covariance_chi_squared,
+                        name,
+                        key,
+                        simulations,
+                        NORMALIZATION_UNCERTAINTY,
+                    )
+
+            for key, (input, _, stale) in pending.items():
+                for (value_key, job, dependencies, _), value in zip(
+                    stale, futures[key].result()
+                ):
+                    store[value_key] = {
+                        "reaction": reaction_name(input),
+                        "residual": residual_name(input),
+                        "case": job["case"],
+                        "chi_squared": float(value),
+                        "n_datasets": len(dependencies["exfor"]),
+                        "dependencies": dependencies,
+                    }
+                    recomputed += 1
+
+    save_chi_squared_store(store)
+    print(f"Chi-squared: {recomputed} values recomputed, {unchanged} unchanged")
+
+    return store
+
+
+
+## Monte Carlo ranking
+## Replicas resample every experimental point within delta_cross_exp and the
+## datasets with replacement; the fraction of replicas in which a parameter
+## case has the lowest chi-squared is its probability of being the best.
+
+
+def load_dataset_arrays(external_files, error_threshold=ERROR_THRESHOLD):
+    ## (energy, cross_section, delta_cross) arrays of the points that
+    ## calculate_combined_chi_squared would use
+    datasets = []
+    for external_file in external_files:
+        data = np.array(load_experimental_data(external_file), ndmin=2)
+        if data.size == 0:
+            continue
+
+        energy, cross_section, delta_cross = data[:, 0], data[:, 2], data[:, 3]
+        valid = (delta_cross >= error_threshold * cross_section) & (delta_cross > 0)
+        if valid.any():
+            datasets.append((energy[valid], cross_section[valid], delta_cross[valid]))
+
+    return datasets
+
+
+def interpolate_cases(energy, simulations):
+    ## (case, point) simulated cross sections, NaN outside a case's energy range
+    return np.array(
+        [
+            np.interp(energy, sim[:, 0], sim[:, 1], left=np.nan, right=np.nan)
+            if sim is not None and len(sim)
+            else np.full(len(energy), np.nan)
+            for sim in simulations
+        ]
+    )
+
+
+def monte_carlo_chi_squared(datasets, simulations, n_replicas=MC_REPLICAS, rng=None):
+    ## (replica, case) combined chi-squared, NaN where a case has no valid dataset
+    rng = rng or np.random.default_rng()
+    n_cases = len(simulations)
+
+    dataset_chi_squared = np.full((len(datasets), n_replicas, n_cases), np.nan)
+    for d, (energy, cross_section, delta_cross) in enumerate(datasets):
+        sim = interpolate_cases(energy, simulations)  # (case, point)
+        replicas = cross_section + delta_cross * rng.standard_normal(
+            (n_replicas, len(energy))
+        )  # (replica, point)
+
+        residuals = (replicas[:, None, :] - sim[None, :, :]) / delta_cross
+        points = (~np.isnan(sim)).sum(axis=1)  # valid points per case
+        dataset_chi_squared[d] = np.where(
+            points > 0, np.nansum(residuals**2, axis=2) / np.maximum(points, 1), np.nan
+        )
+
+    ## resample datasets with replacement
+    picks = rng.integers(0, len(datasets), size=(len(datasets), n_replicas))
+    resampled = dataset_chi_squared[picks, np.arange(n_replicas)[None, :], :]
+
+    return masked_mean(resampled, axis=0)
+
+
+def masked_mean(values, axis):
+    ## mean ignoring NaN, NaN where nothing is left (without nanmean warnings)
+    valid = ~np.isnan(values)
+    count = valid.sum(axis=axis)
+    total = np.where(valid, values, 0.0).sum(axis=axis)
+    return np.where(count > 0, total / np.maximum(count, 1), np.nan)
+
+
+def nominal_chi_squared(datasets, simulations):
+    ## (case,) combined chi-squared of the unperturbed data, the same value as
+    ## calculate_combined_chi_squared without reading or writing files
+    if not datasets:
+        return np.full(len(simulations), np.nan)
+
+    dataset_chi_squared = []
+    for energy, cross_section, delta_cross in datasets:
+        sim = interpolate_cases(energy, simulations)
+        points = (~np.isnan(sim)).sum(axis=1)
+        dataset_chi_squared.append(
+            np.where(
+                points > 0,
+                np.nansum(((cross_section - sim) / delta_cross) ** 2, axis=1)
+                / np.maximum(points, 1),
+                np.nan,
+            )
+        )
+
+    return masked_mean(np.array(dataset_chi_squared), axis=0)
+
+
+## Covariance chi-squared
+## The covariance of a dataset is diag(delta_cross^2) plus the fully
+## correlated normalization part (NORMALIZATION_UNCERTAINTY x cross_section)^2.
+## Its Cholesky factor L is computed once per dataset (and per subset of
+## points a case covers) and the whitening matrix L^-1 is cached, so scoring
+## more cases is a single matrix product: chi-squared = |L^-1 (data - sim)|^2.
+
+## whitening matrices by dataset and point subset
+_whitening = {}
+
+
+def whitening_matrix(cross_section, delta_cross, normalization):
+    key = (cross_section.tobytes(), delta_cross.tobytes(), normalization)
+    if key not in _whitening:
+        systematic = normalization * cross_section
+        covariance = np.diag(delta_cross**2) + np.outer(systematic, systematic)
+        factor = np.linalg.cholesky(covariance)
+        _whitening[key] = np.linalg.solve(factor, np.eye(len(cross_section)))
+
+    return _whitening[key]
+
+
+def covariance_chi_squared(datasets, simulations, normalization=NORMALIZATION_UNCERTAINTY):
+    ## (case,) combined chi-squared like nominal_chi_squared, per dataset
+    ## divided by its number of points and averaged over the datasets
+    if not datasets:
+        return np.full(len(simulations), np.nan)
+
+    dataset_chi_squared = []
+    for energy, cross_section, delta_cross in datasets:
+        sim = interpolate_cases(energy, simulations)
+        valid = ~np.isnan(sim)
+        values = np.full(len(simulations), np.nan)
+
+        ## cases covering the same points share one factorization
+        masks, inverse = np.unique(valid, axis=0, return_inverse=True)
+        for k, mask in enumerate(masks):
+            if not mask.any():
+                continue
+            cases = np.flatnonzero(inverse.reshape(-1) == k)
+            whitening = whitening_matrix(
+                cross_section[mask], delta_cross[mask], normalization
+            )
+            residuals = whitening @ (cross_section[mask, None] - sim[cases][:, mask].T)
+            values[cases] = (residuals**2).sum(axis=0) / mask.sum()
+
+        dataset_chi_squared.append(values)
+
+    return masked_mean(np.array(dataset_chi_squared), axis=0)
+
+
+def best_case_probability(chi_squared):
+    ## chi_squared: (replica, case)
+    usable = ~np.isnan(chi_squared).all(axis=1)
+    if not usable.any():
+        return np.full(chi_squared.shape[1], np.nan)
+
+    ## tied cases share a replica
+    values = chi_squared[usable]
+    best = values == np.nanmin(values, axis=1, keepdims=True)
+    return (best / best.sum(axis=1, keepdims=True)).sum(axis=0) / usable.sum()
+
+
+def monte_carlo_ranking(
+    medical_isotope_reactions,
+    jobs,
+    score_dict,
+    n_replicas=MC_REPLICAS,
+    exfor_index=None,
+    save=True,
+    cube=None,
+    n_workers=N,
+):
+    ## save: write the ranking to MC_RANKING_FILE
+    ## cube: (cube, metadata) to read the TALYS cross sections from
+    ## One task per residual in a process pool sharing the datasets.
+    n_cases = max(job["case"] for job in jobs) + 1
+    jobs_by_reaction = {}
+    for job in jobs:
+        jobs_by_reaction.setdefault(reaction_name(job["input"]), []).append(job)
+
+    datasets = {}
+    simulations = {}
+    for input in medical_isotope_reactions:
+        key = f"{reaction_name(input)} {residual_name(input)}"
+        _, external_files = reaction_external_files(input, score_dict, exfor_index)
+        datasets[key] = load_dataset_arrays(external_files)
+        if not datasets[key]:
+            del datasets[key]
+            continue
+
+        simulations[key] = [None] * n_cases
+        for job in jobs_by_reaction.get(reaction_name(input), []):
+            output = simulation_output(job, input, cube)
+            if output is not None:
+                simulations[key][job["case"]] = load_simulation(job, input, output[1])
+
+    ## independent random streams for the tasks
+    seeds = np.random.SeedSequence().spawn(len(datasets))
+    futures = {}
+    if datasets:
+        with dataset_pool(datasets, n_workers) as (executor, name):
+            for key, seed in zip(datasets, seeds):
+                futures[key] = executor.submit(
+                    shared_task,
+                    monte_carlo_chi_squared,
+                    name,
+                    key,
+                    simulations[key],
+                    n_replicas,
+                    np.random.default_rng(seed),
+                )
+
+    ranking = {}
+    for key, future in futures.items():
+        chi_squared = future.result()
+        probability = best_case_probability(chi_squared)
+
+        mean = masked_mean(chi_squared, axis=0)
+        ranking[key] = {
+            "probability": probability.tolist(),
+            "chi_squared_mean": mean.tolist(),
+            "chi_squared_std": np.sqrt(masked_mean((chi_squared - mean) ** 2, axis=0)).tolist(),
+        }
+        print(
+            f"{key}: P(best) = "
+            + ", ".join(f"case {i}: {p:.3f}" for i, p in enumerate(probability))
+        )
+
+    if save:
+        os.makedirs(CALC_PATH, exist_ok=True)
+        with open(os.path.join(CALC_PATH, MC_RANKING_FILE), "w") as f:
+            json.dump(ranking, f, indent=1)
+
+    return ranking
+
+
+if __name__ == "__main__":
+    ## refresh after score table or EXFOR changes, without running TALYS
+    from talys_jobs import get_IAEA_medical_isotope_nuclides, build_talys_jobs
+    from score_table import get_score_tables
+
+    medical_isotope_reactions = get_IAEA_medical_isotope_nuclides()
+    update_chi_squared(
+        medical_isotope_reactions,
+        build_talys_jobs(medical_isotope_reactions),
+        get_score_tables(),
+    )
@@ -0,0 +1,212 @@
+import os
+import sys
+import json
+import argparse
+
+from config import CALC_PATH, CHI2_STORE_FILE, RUNTIME_HISTORY_FILE, XS_CUBE_FILE, N
+
+
+## Command-line interface:
+##     python cli.py plan|run|score|rank|plot|status [-r p-Cd111 "p-Cu063 Zn062"]
+##     python cli.py submit -r "p-Cd111 In111" -p "ldmodel 5"
+##     python cli.py import [--root DIR]
+## NumPy, plotting, the scheduler and the score tables are imported inside the
+## subcommands that need them, so that plan and status answer immediately.
+## plan is a dry run: runs found in the run cache are left out and the rest
+## is costed from the runtime history.
+
+
+def selected_jobs(args):
+    from talys_jobs import (
+        get_IAEA_medical_isotope_nuclides,
+        build_talys_jobs,
+        select_reactions,
+    )
+
+    reactions = select_reactions(get_IAEA_medical_isotope_nuclides(), args.reactions)
+    return reactions, build_talys_jobs(reactions)
+
+
+def plan(args):
+    ## dry run: nothing is launched
+    from talys_jobs import run_status
+    from scheduler import plan_jobs
+
+    reactions, jobs = selected_jobs(args)
+    if args.verbose:
+        for job in jobs:
+            parameters = " ".join(f"{k} {v}" for k, v in job["parameters"].items())
+            print(f"{job['name']:32s} {run_status(job):8s} {parameters}")
+
+    print(f"{len(reactions)} reactions")
+    plan_jobs(jobs, args.workers, args.force)
+
+
+def status(args):
+    from talys_jobs import run_status
+
+    _, jobs = selected_jobs(args)
+    counts = {"done": 0, "stale": 0, "failed": 0, "pending": 0}
+    for job in jobs:
+        counts[run_status(job)] += 1
+    print(", ".join(f"{count} {state}" for state, count in counts.items()))
+
+    history = os.path.join(CALC_PATH, RUNTIME_HISTORY_FILE)
+    if os.path.exists(history):
+        with open(history) as f:
+            print(f"{sum(1 for _ in f)} runs in the runtime history")
+
+    store = os.path.join(CALC_PATH, CHI2_STORE_FILE)
+    if os.path.exists(store):
+        with open(store) as f:
+            print(f"{len(json.load(f))} chi-squared values stored")
+
+    cube = os.path.join(CALC_PATH, XS_CUBE_FILE)
+    print(f"Cross section cube: {cube if os.path.exists(cube) else 'not built'}")
+
+
+def run(args):
+    from campaign import Campaign
+
+    campaign = Campaign(n_workers=args.workers)
+    campaign.run(args.reactions, skip_done=not args.force)
+
+
+def parse_parameters(args):
+    ## case parameters with -p "ldmodel 5" -p "rwdadjust p 1.05" applied
+    from talys_jobs import parameter_check_cases
+
+    parameters = dict(parameter_check_cases[args.case])
+    for parameter in args.parameter or []:
+        keyword, value = parameter.rsplit(" ", 1)
+        for convert in (int, float, str):
+            try:
+                parameters[keyword] = convert(value)
+                break
+            except ValueError:
+                continue
+
+    return parameters
+
+
+def submit(args):
+    ## interactive lane of the running scheduler, or run now if none is running
+    from talys_jobs import get_IAEA_medical_isotope_nuclides, select_reaction
+    from job_queue import interactive_job, submit_job, scheduler_running
+
+    try:
+        input = select_reaction(get_IAEA_medical_isotope_nuclides(), args.reactions)
+    except ValueError as e:
+        print(e)
+        return 1
+
+    job = interactive_job(input, parse_parameters(args))
+    if scheduler_running():
+        submit_job(job)
+    else:
+        from scheduler import run_jobs
+
+        run_jobs([job], 1)
+
+
+def import_runs(args):
+    from backfill import backfill_run_cache
+
+    backfill_run_cache(args.root, args.talys_path, args.workers)
+
+
+def score(args):
+    from campaign import Campaign
+
+    chi_squared = Campaign().score(args.reactions)
+    for key, value in chi_squared.items():
+        print(f"{key}\t{value:.6f}")
+
+
+def rank(args):
+    from campaign import Campaign
+
+    campaign = Campaign()
+    for key, values in campaign.rank(args.reactions).items():
+        print(f"{key}\t" + "  ".join(f"case {case}: {value:.4f}" for case, value in values))
+
+    if args.replicas:
+        campaign.best_case_probability(args.reactions, args.replicas)
+
+
+def plot(args):
+    from campaign import Campaign
+
+    for plot_file in Campaign().plot(args.reactions, args.force):
+        print(plot_file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="cli.py", description="TALYS parameter optimization campaign"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    commands = {
+        "plan": (plan, "estimate the TALYS runs, time and disk a campaign needs"),
+        "run": (run, "run TALYS for the runs not done yet"),
+        "score": (score, "update chi-squared values"),
+        "rank": (rank, "rank the parameter cases by chi-squared"),
+        "plot": (plot, "plot TALYS cases against EXFOR data"),
+        "status": (status, "summarise finished, failed and pending runs"),
+        "submit": (submit, "run one reaction ahead of the running campaign"),
+        "import": (import_runs, "register existing run directories in the run cache"),
+    }
+    for name, (function, help) in commands.items():
+        subparser = subparsers.add_parser(name, help=help)
+        if name == "submit":
+            subparser.add_argument(
+                "-r", "--reactions", required=True, help='one residual, e.g. "p-Cd111 In111"'
+            )
+        else:
+            subparser.add_argument(
+                "-r",
+                "--reactions",
+                nargs="+",
+                help='e.g. p-Cd111 "p-Cu063 Zn062" (default: the whole IAEA list)',
+            )
+        subparser.set_defaults(function=function)
+
+    subparsers.choices["plan"].add_argument("-v", "--verbose", action="store_true")
+    for name in ("plan", "run"):
+        subparsers.choices[name].add_argument(
+            "--force", action="store_true", help="rerun finished runs"
+        )
+    subparsers.choices["plot"].add_argument(
+        "--force", action="store_true", help="render plots that are up to date"
+    )
+    for name in ("plan", "run", "import"):
+        subparsers.choices[name].add_argument("-n", "--workers", type=int, default=N)
+    subparsers.choices["import"].add_argument(
+        "--root", help="directory to search (default: CALC_PATH)"
+    )
+    subparsers.choices["import"].add_argument(
+        "--talys-path", help="TALYS installation of the runs (default: TALYS_PATH)"
+    )
+    subparsers.choices["submit"].add_argument(
+        "--case", type=int, default=0, help="parameter case to start from"
+    )
+    subparsers.choices["submit"].add_argument(
+        "-p",
+        "--parameter",
+        action="append",
+        help='e.g. -p "ldmodel 5" -p "rwdadjust p 1.05"',
+    )
+    subparsers.choices["rank"].add_argument(
+        "--replicas",
+        type=int,
+        default=0,
+        help="also report the Monte Carlo probability of each case being best",
+    )
+
+    args = parser.parse_args(argv)
+    return args.function(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
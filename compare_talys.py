@@ -0,0 +1,164 @@
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from config import (
+    CALC_PATH,
+    TALYS_INP_FILE_NAME,
+    COMPARE_TOLERANCE,
+    COMPARE_MIN_CROSS_SECTION,
+    N,
+)
+from run_cache import load_run_cache, cached_run, talys_binary_id
+from scheduler import run_jobs
+from talys_jobs import build_talys_jobs, frange, reaction_name, residual_name
+from xs_cube import load_residual_output
+
+
+## Regression comparison of two TALYS installations. Both run the same
+## talys.inp of every campaign job; runs already in the run cache for a
+## binary are reused, so after an upgrade only the new binary is run. Runs
+## are looked up by input and binary only (never by what a directory holds,
+## which may come from the build replaced in TALYS_PATH) and new ones go to
+## CALC_PATH/compare/<binary id>. The residual cross sections are compared
+## on the energy grid of the jobs.
+
+
+def versioned_jobs(jobs, talys_path):
+    ## the same jobs run with the given TALYS installation
+    binary_id = talys_binary_id(talys_path)
+    if binary_id is None:
+        raise FileNotFoundError(f"No TALYS binary in {talys_path}/bin")
+
+    versioned = []
+    for job in jobs:
+        calc_directory = os.path.join(CALC_PATH, "compare", binary_id, job["name"])
+        versioned.append(
+            dict(
+                job,
+                talys_path=talys_path,
+                calc_directory=calc_directory,
+                input_file=os.path.join(calc_directory, TALYS_INP_FILE_NAME),
+            )
+        )
+
+    return versioned
+
+
+def run_version(jobs, n_workers=N):
+    ## {job name: run directory}, running only what is not cached
+    run_cache = load_run_cache()
+    missing = [
+        job for job in jobs if cached_run(run_cache, job, directory=False) is None
+    ]
+    if missing:
+        print(f"{len(missing)} of {len(jobs)} runs not cached for this TALYS binary")
+        run_jobs(missing, n_workers)
+        run_cache = load_run_cache()
+
+    return {job["name"]: cached_run(run_cache, job, directory=False) for job in jobs}
+
+
+def compare_residual(reference_directory, candidate_directory, residual, energies):
+    ## relative difference per energy, None if either run has no output
+    if reference_directory is None or candidate_directory is None:
+        return None
+    reference = load_residual_output(reference_directory, residual)
+    candidate = load_residual_output(candidate_directory, residual)
+    if reference is None or candidate is None:
+        return None
+
+    a = np.interp(energies, reference[:, 0], reference[:, 1], left=np.nan, right=np.nan)
+    b = np.interp(energies, candidate[:, 0], candidate[:, 1], left=np.nan, right=np.nan)
+    scale = np.maximum(np.maximum(np.abs(a), np.abs(b)), COMPARE_MIN_CROSS_SECTION)
+    difference = np.abs(a - b) / scale
+
+    ## both negligible: no difference
+    negligible = (np.abs(a) < COMPARE_MIN_CROSS_SECTION) & (
+        np.abs(b) < COMPARE_MIN_CROSS_SECTION
+    )
+    return np.where(negligible, 0.0, difference)
+
+
+def compare_talys_versions(
+    medical_isotope_reactions,
+    reference_path,
+    candidate_path,
+    cases=None,
+    tolerance=COMPARE_TOLERANCE,
+    n_workers=N,
+):
+    jobs = build_talys_jobs(medical_isotope_reactions, cases)
+    reference_jobs = versioned_jobs(jobs, reference_path)
+    candidate_jobs = versioned_jobs(jobs, candidate_path)
+
+    reference = run_version(reference_jobs, n_workers)
+    candidate = run_version(candidate_jobs, n_workers)
+
+    comparisons = []
+    for input in medical_isotope_reactions:
+        for job in jobs:
+            if reaction_name(job["input"]) != reaction_name(input):
+                continue
+            emin, emax, estep = [float(e) for e in job["energy_range"].split()]
+            comparisons.append(
+                (
+                    f"{reaction_name(input)} {residual_name(input)} {job['case']}",
+                    reference[job["name"]],
+                    candidate[job["name"]],
+                    residual_name(input),
+                    np.array(list(frange(emin, emax, estep))),
+                )
+            )
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        differences = list(
+            executor.map(lambda c: compare_residual(*c[1:]), comparisons)
+        )
+
+    report = {}
+    missing = []
+    for (key, _, _, _, energies), difference in zip(comparisons, differences):
+        if difference is None:
+            missing.append(key)
+            continue
+        exceeding = np.flatnonzero(np.nan_to_num(difference) > tolerance)
+        if exceeding.size:
+            report[key] = {
+                "max_difference": float(np.nanmax(difference)),
+                "energies": energies[exceeding].tolist(),
+                "differences": difference[exceeding].tolist(),
+            }
+
+    for key, value in sorted(
+        report.items(), key=lambda item: item[1]["max_difference"], reverse=True
+    ):
+        print(
+            f"{key}: up to {value['max_difference']:.1%} at "
+            f"{len(value['energies'])} energies"
+        )
+    print(
+        f"{len(report)} of {len(comparisons)} cross sections differ by more than "
+        f"{tolerance:.1%}, {len(missing)} missing in either version"
+    )
+
+    os.makedirs(os.path.join(CALC_PATH, "compare"), exist_ok=True)
+    report_file = os.path.join(
+        CALC_PATH,
+        "compare",
+        f"{talys_binary_id(reference_path)}_{talys_binary_id(candidate_path)}.json",
+    )
+    with open(report_file, "w") as f:
+        json.dump({"differences": report, "missing": missing}, f, indent=1)
+
+    return report, missing
+
+
+if __name__ == "__main__":
+    import sys
+    from talys_jobs import get_IAEA_medical_isotope_nuclides
+
+    ## python compare_talys.py <reference TALYS path> <candidate TALYS path>
+    compare_talys_versions(get_IAEA_medical_isotope_nuclides(), sys.argv[1], sys.argv[2])
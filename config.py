@@ -12,8 +12,89 @@ ENERGY_RANGE_MIN = 5.0
 ENERGY_RANGE_MAX = 45.0
 ENERGY_STEP = 40.0
 
+## Sensitivity analysis
+## adjustment keywords perturbed for every target (gadjust of the compound
+## nucleus, target and residuals are added per reaction)
+SENSITIVITY_PARAMETERS = ["rwdadjust p", "awdadjust p", "rvadjust n"]
+## relative finite-difference step of the adjustment factors
+SENSITIVITY_STEP = 0.05
+## parameters with max |d ln(xs) / d ln(p)| below this are insensitive
+SENSITIVITY_THRESHOLD = 0.05
+
+## Parameter search
+## best adjustment factors per target, under CALC_PATH
+BEST_PARAMETERS_FILE = "best_parameters.json"
+OPTIMIZE_STEP = 0.1
+OPTIMIZE_MIN_STEP = 0.01
+OPTIMIZE_BOUNDS = (0.5, 1.5)
+OPTIMIZE_MAX_ITERATIONS = 20
+## neighbours further away in Z do not seed the search
+OPTIMIZE_NEIGHBOUR_MAX_DZ = 2
+
 ## [ChiSquaredConfig]
 ERROR_THRESHOLD = 0.05
+## covariance chi-squared: statistical uncertainties plus a fully correlated
+## normalization uncertainty (relative) per dataset; None: independent points
+NORMALIZATION_UNCERTAINTY = None
+## chi-squared values with their dependencies, under CALC_PATH
+CHI2_STORE_FILE = "chi_squared.json"
+## Monte Carlo ranking of the parameter cases (0: off)
+MC_REPLICAS = 1000
+MC_RANKING_FILE = "best_case_probability.json"
+## global selection: one parameter case per mass window of enriched targets
+## and per Z window of natural targets
+REGION_A_WIDTH = 20
+REGION_Z_WIDTH = 10
+GLOBAL_SELECTION_FILE = "global_selection.json"
+
+## TALYS version comparison: relative difference reported above the
+## tolerance, cross sections below COMPARE_MIN_CROSS_SECTION (mb) ignored
+COMPARE_TOLERANCE = 0.01
+COMPARE_MIN_CROSS_SECTION = 1e-3
+
+## Adaptive energy grid: extra energies are added around points where linear
+## interpolation misses the cross section by more than REFINE_TOLERANCE
+## (relative to the peak) and in threshold intervals, down to REFINE_MIN_STEP
+REFINE_TOLERANCE = 0.02
+REFINE_MIN_STEP = 0.25
+REFINE_MAX_LEVELS = 3
+REFINE_ENERGY_FILE = "energies"
 
 ## Numver of parallel processes
 N = 4
+
+## Scheduler
+## measured TALYS run times, appended under CALC_PATH after every run
+RUNTIME_HISTORY_FILE = "runtime_history.jsonl"
+## finished runs by talys.inp hash, under CALC_PATH
+RUN_CACHE_FILE = "run_cache.json"
+
+## Results
+## residual cross sections of all runs (memory-mapped, under CALC_PATH)
+## with the axis labels in a .json sidecar of the same name
+XS_CUBE_FILE = "xs_cube.npy"
+
+## Watchdog
+## a run is killed after TIMEOUT_FACTOR x its expected runtime (at least
+## TIMEOUT_MIN seconds), or after TIMEOUT_DEFAULT seconds while there is no
+## runtime history to fit, and retried up to MAX_RETRIES times
+WATCHDOG_POLL_INTERVAL = 1.0
+TIMEOUT_FACTOR = 5.0
+TIMEOUT_MIN = 600.0
+TIMEOUT_DEFAULT = 12 * TIMEOUT_MIN
+MAX_RETRIES = 2
+## duplicate runs slower than SPECULATIVE_FACTOR x expected when workers are idle
+SPECULATIVE = True
+SPECULATIVE_FACTOR = 1.5
+SPECULATIVE_CHECK_INTERVAL = 10.0
+
+## Resource budgets (MB, None: unlimited)
+## new runs are only started while the expected peak memory of all running
+## TALYS jobs and the output written by this campaign stay within budget
+MEMORY_BUDGET = None
+DISK_BUDGET = None
+
+## Priority lanes: seconds between checks of CALC_PATH/queue for submitted
+## jobs, and whether campaign runs are stopped while interactive jobs wait
+QUEUE_POLL_INTERVAL = 2.0
+PREEMPT = False
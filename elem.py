@@ -146,6 +146,9 @@ ELEMS = [
     "125",
 ]
 
+## symbol -> Z, instead of searching ELEMS
+ELEM_TO_Z = {elem: z for z, elem in enumerate(ELEMS, start=1)}
+
 
 def ztoelem(z):
     if z == 0:
@@ -162,23 +165,13 @@ def ztoelem(z):
 
 
 def elemtoz(elem):
-    try:
-        z = ELEMS.index(elem)
-        z = z + 1
-        z = str(z).zfill(3)
-    except ValueError:
-        z = ""
-    return z
+    z = ELEM_TO_Z.get(elem)
+    return str(z).zfill(3) if z else ""
 
 
 def elemtoz_nz(elem):
-    try:
-        z = ELEMS.index(elem)
-        z = z + 1
-        z = str(z)
-    except ValueError:
-        z = ""
-    return z
+    z = ELEM_TO_Z.get(elem)
+    return str(z) if z else ""
 
 
 def numtoisomer(num):
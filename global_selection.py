@@ -0,0 +1,153 @@
+import os
+import json
+
+import numpy as np
+
+from config import (
+    CALC_PATH,
+    REGION_A_WIDTH,
+    REGION_Z_WIDTH,
+    GLOBAL_SELECTION_FILE,
+)
+from chi_squared import load_chi_squared_store
+from nuclide import Nuclide
+
+
+## Global parameter selection
+## The chi-squared store is turned into a (reaction x residual, case) matrix
+## and every row is assigned a region: enriched targets by mass window of
+## REGION_A_WIDTH, natural targets by Z window of REGION_Z_WIDTH. The best
+## case of a region minimises the chi-squared averaged over its rows with the
+## number of EXFOR datasets as weight. Leaving one row out at a time shows
+## whether a region's choice hangs on a single reaction.
+
+
+def chi_squared_matrix(store, n_cases=None):
+    ## rows with experimental data: keys "<reaction> <residual>", chi-squared
+    ## (row, case) with NaN where missing, and the number of datasets per row
+    entries = [value for value in store.values() if value["n_datasets"]]
+    if n_cases is None:
+        n_cases = max((value["case"] for value in entries), default=-1) + 1
+
+    keys = sorted({f"{value['reaction']} {value['residual']}" for value in entries})
+    row = {key: i for i, key in enumerate(keys)}
+
+    chi_squared = np.full((len(keys), n_cases), np.nan)
+    weights = np.zeros(len(keys))
+    for value in entries:
+        i = row[f"{value['reaction']} {value['residual']}"]
+        chi_squared[i, value["case"]] = value["chi_squared"]
+        weights[i] = value["n_datasets"]
+
+    return keys, chi_squared, weights
+
+
+def target_region(reaction):
+    ## e.g. "p-Cd111" -> "A 100-119", "p-Br0" -> "natural Z 30-39"
+    target = Nuclide(reaction.split("-")[1])
+    if target.natural:
+        low = target.z // REGION_Z_WIDTH * REGION_Z_WIDTH
+        return f"natural Z {low}-{low + REGION_Z_WIDTH - 1}"
+
+    low = target.a // REGION_A_WIDTH * REGION_A_WIDTH
+    return f"A {low}-{low + REGION_A_WIDTH - 1}"
+
+
+def region_sums(region, chi_squared, weights, n_regions):
+    ## weighted chi-squared sums and weights per (region, case)
+    valid = np.isfinite(chi_squared)
+    weighted = np.where(valid, chi_squared * weights[:, None], 0.0)
+    counted = valid * weights[:, None]
+
+    sums = np.zeros((n_regions, chi_squared.shape[1]))
+    totals = np.zeros((n_regions, chi_squared.shape[1]))
+    np.add.at(sums, region, weighted)
+    np.add.at(totals, region, counted)
+
+    return sums, totals, weighted, counted
+
+
+def best_cases(sums, totals):
+    ## weighted mean chi-squared and its best case, -1 where nothing is left
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(totals > 0, sums / totals, np.inf)
+
+    best = np.argmin(mean, axis=-1)
+    best = np.where(np.isfinite(mean.min(axis=-1)), best, -1)
+    return mean, best
+
+
+def save_selection(selection):
+    os.makedirs(CALC_PATH, exist_ok=True)
+    with open(os.path.join(CALC_PATH, GLOBAL_SELECTION_FILE), "w") as f:
+        json.dump(selection, f, indent=1)
+
+
+def select_global_parameters(store=None, n_cases=None):
+    if store is None:
+        store = load_chi_squared_store()
+
+    keys, chi_squared, weights = chi_squared_matrix(store, n_cases)
+    if not keys or not chi_squared.shape[1]:
+        print("No chi-squared values with experimental data, nothing to select")
+        save_selection({})
+        return {}
+
+    names, region = np.unique(
+        [target_region(key.split()[0]) for key in keys], return_inverse=True
+    )
+    region = region.reshape(-1)
+
+    sums, totals, weighted, counted = region_sums(
+        region, chi_squared, weights, len(names)
+    )
+    mean, best = best_cases(sums, totals)
+
+    ## leave one out: remove every row from its region's sums at once
+    _, loo_best = best_cases(sums[region] - weighted, totals[region] - counted)
+    rows = np.arange(len(keys))
+    stable = loo_best == best[region]
+    ## held-out chi-squared at the case chosen without the row
+    held_out = np.where(
+        loo_best >= 0, chi_squared[rows, np.maximum(loo_best, 0)], np.nan
+    )
+
+    selection = {}
+    for r, name in enumerate(names):
+        members = rows[region == r]
+        ## a single row leaves nothing to choose from
+        loo_stable = float(stable[members].mean()) if len(members) > 1 else None
+        selection[str(name)] = {
+            "best_case": int(best[r]),
+            "chi_squared": [
+                None if not np.isfinite(m) else float(m) for m in mean[r]
+            ],
+            "reactions": [keys[i] for i in members],
+            "n_datasets": int(weights[members].sum()),
+            "leave_one_out_stable": loo_stable,
+            "leave_one_out": {
+                keys[i]: {
+                    "best_case": int(loo_best[i]),
+                    "chi_squared": None
+                    if not np.isfinite(held_out[i])
+                    else float(held_out[i]),
+                }
+                for i in members
+            },
+        }
+        print(
+            f"{name}: case {best[r]} ({len(members)} residuals, "
+            f"{int(weights[members].sum())} datasets), "
+            + (
+                f"leave-one-out agrees for {loo_stable:.0%}"
+                if loo_stable is not None
+                else "leave-one-out n/a"
+            )
+        )
+
+    save_selection(selection)
+    return selection
+
+
+if __name__ == "__main__":
+    select_global_parameters()
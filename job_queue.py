@@ -0,0 +1,147 @@
+import os
+import json
+import time
+
+from config import (
+    CALC_PATH,
+    TALYS_INP_FILE_NAME,
+    ENERGY_RANGE_MIN,
+    ENERGY_RANGE_MAX,
+    ENERGY_STEP,
+)
+from nuclide import Nuclide
+from run_cache import input_hash
+from utils import split_by_number
+
+
+## Interactive job queue
+## Single runs submitted from the CLI or a notebook are spooled as JSON files
+## in CALC_PATH/queue. A running scheduler (its pid in queue/scheduler.pid)
+## picks them up between dispatches and puts them in the interactive lane,
+## ahead of the campaign jobs.
+
+
+def queue_directory():
+    return os.path.join(CALC_PATH, "queue")
+
+
+def scheduler_pid_file():
+    return os.path.join(queue_directory(), "scheduler.pid")
+
+
+def scheduler_pid():
+    ## pid of the running scheduler, None if there is none
+    try:
+        with open(scheduler_pid_file()) as f:
+            pid = int(f.read())
+        os.kill(pid, 0)
+    except (OSError, ValueError):
+        return None
+    return pid
+
+
+def scheduler_running():
+    return scheduler_pid() is not None
+
+
+def register_scheduler():
+    ## announce this process to submit_job; only one scheduler owns the queue
+    pid = scheduler_pid()
+    if pid is not None and pid != os.getpid():
+        raise RuntimeError(
+            f"Another scheduler is running (pid {pid}), submit jobs to it instead"
+        )
+
+    os.makedirs(queue_directory(), exist_ok=True)
+    with open(scheduler_pid_file(), "w") as f:
+        f.write(str(os.getpid()))
+
+
+def unregister_scheduler():
+    ## remove the pid file unless another scheduler has taken it over
+    try:
+        with open(scheduler_pid_file()) as f:
+            owner = f.read()
+        if owner == str(os.getpid()):
+            os.remove(scheduler_pid_file())
+    except FileNotFoundError:
+        pass
+
+
+def reaction_input(projectile, target, residual):
+    ## the input dict of get_IAEA_medical_isotope_nuclides, e.g. ("p", "Cd111", "In111")
+    return {
+        "projectile": projectile,
+        "element": split_by_number(target)[0],
+        "mass": split_by_number(target)[1],
+        "target": split_by_number(target),
+        "residual": split_by_number(residual),
+        "target_nuclide": Nuclide(target),
+        "residual_nuclide": Nuclide(residual),
+    }
+
+
+def interactive_job(input, parameters, energy_range=None):
+    energy_range = energy_range or f"{ENERGY_RANGE_MIN} {ENERGY_RANGE_MAX} {ENERGY_STEP}"
+    job = {
+        "input": input,
+        "case": 0,
+        "parameters": parameters,
+        "energy_range": energy_range,
+        "lane": "interactive",
+    }
+
+    ## one directory per distinct input
+    job["name"] = (
+        f"{input['projectile']}-{input['element']}{int(input['mass'])}"
+        f"_interactive_{input_hash(job)[:8]}"
+    )
+    job["calc_directory"] = os.path.join(CALC_PATH, "interactive", job["name"])
+    job["input_file"] = os.path.join(job["calc_directory"], TALYS_INP_FILE_NAME)
+    return job
+
+
+def submit_job(job):
+    os.makedirs(queue_directory(), exist_ok=True)
+    entry = {
+        "projectile": job["input"]["projectile"],
+        "target": "".join(job["input"]["target"]),
+        "residual": "".join(job["input"]["residual"]),
+        "parameters": job["parameters"],
+        "energy_range": job["energy_range"],
+        "submitted": time.time(),
+    }
+
+    ## written under a temporary name, so the scheduler never reads half a file
+    spool_file = os.path.join(queue_directory(), f"{job['name']}.json")
+    with open(spool_file + ".tmp", "w") as f:
+        json.dump(entry, f, indent=1)
+    os.replace(spool_file + ".tmp", spool_file)
+    print(f"{job['name']} submitted to the interactive lane")
+
+
+def collect_submitted():
+    ## jobs spooled since the last call, oldest first; the spool files are removed
+    try:
+        names = [f for f in os.listdir(queue_directory()) if f.endswith(".json")]
+    except FileNotFoundError:
+        return []
+
+    entries = []
+    for name in names:
+        spool_file = os.path.join(queue_directory(), name)
+        try:
+            with open(spool_file) as f:
+                entries.append(json.load(f))
+            os.remove(spool_file)
+        except (OSError, ValueError) as e:
+            print(f"Could not read the submitted job {name}: {e}")
+
+    jobs = []
+    for entry in sorted(entries, key=lambda entry: entry["submitted"]):
+        input = reaction_input(entry["projectile"], entry["target"], entry["residual"])
+        job = interactive_job(input, entry["parameters"], entry["energy_range"])
+        job["queued"] = entry["submitted"]
+        jobs.append(job)
+
+    return jobs
@@ -0,0 +1,125 @@
+import re
+
+from elem import ELEMS, ELEM_TO_Z, PARTICLES
+
+
+NUCLIDE_PATTERN = re.compile(r"^([A-Za-z]+)(\d+)([a-z]?)$")
+OUTGOING_PATTERN = re.compile(r"(\d*)([npdhag])")
+
+## TALYS rp file extension of the ground state, isomers and total production
+ISOMER_EXTENSIONS = {
+    "": "tot",
+    "g": "L00",
+    "m": "L01",
+    "n": "L02",
+    "l": "L03",
+}
+
+
+class Nuclide:
+    ## Interned nuclide as written in IAEA_medical_isotope.dat, e.g. "In110m".
+    ## Nuclide("In110m") is Nuclide("in110m") is Nuclide.from_za(49, 110, "m"),
+    ## and all derived names are computed once on creation.
+    ## Mass number 0 stands for a natural target (e.g. "Cu000").
+
+    __slots__ = (
+        "name",
+        "symbol",
+        "z",
+        "a",
+        "isomer",
+        "za_code",
+        "code",
+        "product_fname",
+        "rp_filename",
+        "exfor_name",
+    )
+
+    _interned = {}
+
+    def __new__(cls, name):
+        nuclide = cls._interned.get(name)
+        if nuclide is not None:
+            return nuclide
+
+        match = NUCLIDE_PATTERN.match(name)
+        if not match:
+            raise ValueError(f"Not a nuclide: {name}")
+        symbol = match.group(1).capitalize()
+        if symbol not in ELEM_TO_Z:
+            raise ValueError(f"Unknown element in {name}")
+
+        return cls._intern(name, symbol, int(match.group(2)), match.group(3))
+
+    @classmethod
+    def from_za(cls, z, a, isomer=""):
+        if not 1 <= z <= len(ELEMS):
+            raise ValueError(f"No element with Z = {z}")
+        return cls._intern(None, ELEMS[z - 1], a, isomer)
+
+    @classmethod
+    def _intern(cls, name, symbol, a, isomer):
+        canonical = f"{symbol}{a:03}{isomer}"
+        nuclide = cls._interned.get(canonical)
+
+        if nuclide is None:
+            nuclide = object.__new__(cls)
+            nuclide.name = canonical
+            nuclide.symbol = symbol
+            nuclide.z = ELEM_TO_Z[symbol]
+            nuclide.a = a
+            nuclide.isomer = isomer
+            ## e.g. "049110", "049110m" (EXFOR residual directory),
+            ## "049110.L01" and "rp049110.L01" (TALYS output)
+            nuclide.za_code = f"{nuclide.z:03}{a:03}"
+            nuclide.code = nuclide.za_code + isomer
+            nuclide.product_fname = f"{nuclide.za_code}.{ISOMER_EXTENSIONS[isomer]}"
+            nuclide.rp_filename = "rp" + nuclide.product_fname
+            ## EXFOR target directory, e.g. "Cd111"
+            nuclide.exfor_name = f"{symbol}{a:03}"
+            cls._interned[canonical] = nuclide
+
+        if name is not None:
+            cls._interned[name] = nuclide
+        return nuclide
+
+    @property
+    def natural(self):
+        return self.a == 0
+
+    @property
+    def ground_state(self):
+        return Nuclide.from_za(self.z, self.a)
+
+    def residual(self, reaction):
+        ## e.g. Nuclide("Cu063").residual("p2n") -> Nuclide("Zn062")
+        if self.natural:
+            raise ValueError(f"{self.name} is a natural target, no single residual of {reaction}")
+        projectile, outgoing = parse_reaction(reaction)
+        z = self.z + PARTICLES[projectile][1] - sum(PARTICLES[o][1] for o in outgoing)
+        a = self.a + PARTICLES[projectile][0] - sum(PARTICLES[o][0] for o in outgoing)
+        return Nuclide.from_za(z, a)
+
+    def __repr__(self):
+        return f"Nuclide('{self.name}')"
+
+    def __str__(self):
+        return self.name
+
+    def __reduce__(self):
+        ## keep interning across pickling (process pools)
+        return (Nuclide, (self.name,))
+
+
+def parse_reaction(reaction):
+    ## "p2n" -> ("p", ["n", "n"]), "ppn" -> ("p", ["p", "n"])
+    projectile = reaction[0]
+    outgoing = []
+    for count, particle in OUTGOING_PATTERN.findall(reaction[1:]):
+        outgoing += [particle] * int(count or 1)
+    return projectile, outgoing
+
+
+def nuclides(names):
+    ## batch conversion, e.g. a column of IAEA_medical_isotope.dat
+    return [Nuclide(name) for name in names]
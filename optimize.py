@@ -0,0 +1,244 @@
+import os
+import json
+import shutil
+
+import numpy as np
+
+from config import (
+    CALC_PATH,
+    TALYS_INP_FILE_NAME,
+    ENERGY_RANGE_MIN,
+    ENERGY_RANGE_MAX,
+    ENERGY_STEP,
+    N,
+    SENSITIVITY_PARAMETERS,
+    BEST_PARAMETERS_FILE,
+    OPTIMIZE_STEP,
+    OPTIMIZE_MIN_STEP,
+    OPTIMIZE_BOUNDS,
+    OPTIMIZE_MAX_ITERATIONS,
+    OPTIMIZE_NEIGHBOUR_MAX_DZ,
+)
+from chi_squared import exfortables_directory, load_dataset_arrays, nominal_chi_squared
+from plotting import select_external_files
+from scheduler import run_jobs
+from sensitivity import sensitivity_file, sensitive_parameters
+from xs_cube import reaction_name, load_residual_output
+
+
+## Pattern search of the TALYS adjustment factors per target, minimising the
+## chi-squared averaged over the residuals of the target. Each iteration runs
+## the +/- step trials of all parameters as one batch. Targets are processed
+## in (Z, A) order and every search starts from the best parameters found for
+## the nearest finished neighbour (same element first, then adjacent mass).
+
+
+def best_parameters_path():
+    return os.path.join(CALC_PATH, BEST_PARAMETERS_FILE)
+
+
+def load_best_parameters():
+    path = best_parameters_path()
+    if not os.path.exists(path):
+        return {}
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_best_parameters(best):
+    os.makedirs(CALC_PATH, exist_ok=True)
+    with open(best_parameters_path(), "w") as f:
+        json.dump(best, f, indent=1)
+
+
+def find_neighbour(input, best):
+    ## nearest optimised target of the same projectile in (Z, A)
+    target = input["target_nuclide"]
+    candidates = []
+    for reaction, entry in best.items():
+        if entry["projectile"] != input["projectile"] or reaction == reaction_name(input):
+            continue
+
+        dz = abs(entry["z"] - target.z)
+        ## natural targets have no mass number to compare
+        da = abs(entry["a"] - target.a) if entry["a"] and target.a else 0
+        if dz <= OPTIMIZE_NEIGHBOUR_MAX_DZ:
+            candidates.append(((dz, da), reaction))
+
+    return min(candidates)[1] if candidates else None
+
+
+def search_parameters(reaction, residuals):
+    ## sensitive parameters if a sensitivity analysis exists for the reaction
+    if not os.path.exists(sensitivity_file(reaction)):
+        return list(SENSITIVITY_PARAMETERS)
+
+    keywords = []
+    for residual in residuals:
+        for keyword in sensitive_parameters(reaction, residual.name):
+            if keyword not in keywords:
+                keywords.append(keyword)
+
+    return keywords
+
+
+def optimize_job(input, k, parameters, energy_range):
+    name = f"{reaction_name(input)}_optimize_{k}"
+    calc_directory = os.path.join(CALC_PATH, "optimize", name)
+    return {
+        "name": name,
+        "input": input,
+        "case": k,
+        "parameters": parameters,
+        "energy_range": energy_range,
+        "calc_directory": calc_directory,
+        "input_file": os.path.join(calc_directory, TALYS_INP_FILE_NAME),
+    }
+
+
+def optimize_reaction(input, residuals, base_parameters, start, score_dict, n_workers=N):
+    reaction = reaction_name(input)
+    energy_range = f"{ENERGY_RANGE_MIN} {ENERGY_RANGE_MAX} {ENERGY_STEP}"
+    keywords = list(start)
+
+    datasets = {}
+    for residual in residuals:
+        residual_input = dict(input, residual_nuclide=residual)
+        _, external_files = select_external_files(
+            exfortables_directory(residual_input), score_dict
+        )
+        datasets[residual.name] = load_dataset_arrays(external_files)
+
+    if not any(datasets.values()):
+        print(f"{reaction}: no experimental data, skipping the search")
+        return None
+
+    evaluated = {}
+
+    def key_of(point):
+        return tuple(round(point[keyword], 5) for keyword in keywords)
+
+    def evaluate(points):
+        ## run the points not evaluated yet as one batch
+        new = {}
+        for point in points:
+            if key_of(point) not in evaluated:
+                new.setdefault(key_of(point), point)
+
+        jobs = []
+        for i, point in enumerate(new.values()):
+            parameters = dict(base_parameters)
+            parameters.update(point)
+            jobs.append(
+                optimize_job(input, len(evaluated) + i, parameters, energy_range)
+            )
+        ## a failed run must not be scored on an earlier run's output
+        for job in jobs:
+            shutil.rmtree(job["calc_directory"], ignore_errors=True)
+        results = run_jobs(jobs, n_workers) if jobs else {}
+
+        for key, job in zip(new, jobs):
+            if results.get(job["name"], {}).get("status") != "ok":
+                evaluated[key] = np.inf
+                continue
+            chi_squared = [
+                nominal_chi_squared(
+                    datasets[residual.name],
+                    [load_residual_output(job["calc_directory"], residual.name)],
+                )[0]
+                for residual in residuals
+                if datasets[residual.name]
+            ]
+            finite = [c for c in chi_squared if np.isfinite(c)]
+            evaluated[key] = float(np.mean(finite)) if finite else np.inf
+
+        return [evaluated[key_of(point)] for point in points]
+
+    x = dict(start)
+    (fx,) = evaluate([x])
+    step = OPTIMIZE_STEP
+    low, high = OPTIMIZE_BOUNDS
+
+    for iteration in range(OPTIMIZE_MAX_ITERATIONS):
+        if step < OPTIMIZE_MIN_STEP:
+            break
+
+        trials = []
+        for keyword in keywords:
+            for sign in (1, -1):
+                value = round(min(max(x[keyword] + sign * step, low), high), 5)
+                if value != x[keyword]:
+                    trials.append(dict(x, **{keyword: value}))
+
+        values = evaluate(trials)
+        best = int(np.argmin(values)) if values else None
+        if best is not None and values[best] < fx:
+            x, fx = trials[best], values[best]
+        else:
+            step /= 2.0
+
+        print(f"{reaction}: iteration {iteration + 1}, chi-squared {fx:.4f}, step {step:.4f}")
+
+    print(f"{reaction}: {len(evaluated)} TALYS evaluations, best chi-squared {fx:.4f}")
+    return {"parameters": x, "chi_squared": fx, "evaluations": len(evaluated)}
+
+
+def optimize_campaign(medical_isotope_reactions, base_parameters, score_dict, n_workers=N):
+    best = load_best_parameters()
+
+    ## residuals of the same target share the runs
+    targets = {}
+    for input in medical_isotope_reactions:
+        reaction = reaction_name(input)
+        if reaction not in targets:
+            targets[reaction] = (input, [])
+        targets[reaction][1].append(input["residual_nuclide"])
+
+    ## (Z, A) order, so that the previous masses of an element finish first
+    order = sorted(
+        targets,
+        key=lambda r: (targets[r][0]["target_nuclide"].z, targets[r][0]["target_nuclide"].a),
+    )
+
+    for reaction in order:
+        input, residuals = targets[reaction]
+        keywords = search_parameters(reaction, residuals)
+        if not keywords:
+            print(f"{reaction}: no sensitive parameters, skipping the search")
+            continue
+
+        start = {keyword: 1.0 for keyword in keywords}
+        neighbour = find_neighbour(input, best)
+        if neighbour is not None:
+            for keyword, value in best[neighbour]["parameters"].items():
+                if keyword in start:
+                    start[keyword] = value
+            print(f"{reaction}: starting from the best parameters of {neighbour}")
+
+        result = optimize_reaction(
+            input, residuals, base_parameters, start, score_dict, n_workers
+        )
+        if result is None:
+            continue
+
+        target = input["target_nuclide"]
+        best[reaction] = {
+            "projectile": input["projectile"],
+            "z": target.z,
+            "a": target.a,
+            "seed": neighbour,
+            **result,
+        }
+        save_best_parameters(best)
+
+    return best
+
+
+if __name__ == "__main__":
+    from talys_jobs import get_IAEA_medical_isotope_nuclides, parameter_check_cases
+    from score_table import get_score_tables
+
+    optimize_campaign(
+        get_IAEA_medical_isotope_nuclides(), parameter_check_cases[0], get_score_tables()
+    )
@@ -3,9 +3,12 @@ import subprocess
 import colorsys
 import re
 import glob
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 
+from config import N
 from utils import clean_data_file
-from talys_modules import extract_code_from_filename
+from exfor_table import extract_code_from_filename
 from score_table import get_score_tables
 
 
@@ -25,25 +28,14 @@ def load_experimental_data(file_path):
     return experimental_data
 
 
-def retrieve_external_data(
-    exfortables_directory,
-    output_directory,
-    cleaned_external_files,
-    cleaned_all_external_files,
-    product_six_digit_code,
-    score_dict,
-):
+def select_external_files(exfortables_directory, score_dict):
+    ## return all EXFOR tables in the directory and those with weight 1
     all_external_files = [
         f
         for f in glob.glob(os.path.join(exfortables_directory, "*"))
         if not f.endswith(".list")
     ]
 
-    if not all_external_files:
-        print(f"No external data files found in the directory: {exfortables_directory}")
-        return
-
-    # Ask the user whether to include each external file
     external_files = []
     for ext_file in all_external_files:
         file_code = extract_code_from_filename(ext_file)
@@ -58,6 +50,26 @@ def retrieve_external_data(
             print(
                 f"Code '{file_code}' not found in score dict, skipping file '{os.path.basename(ext_file)}'"
             )
+
+    return all_external_files, external_files
+
+
+def retrieve_external_data(
+    exfortables_directory,
+    output_directory,
+    cleaned_external_files,
+    cleaned_all_external_files,
+    product_six_digit_code,
+    score_dict,
+):
+    all_external_files, external_files = select_external_files(
+        exfortables_directory, score_dict
+    )
+
+    if not all_external_files:
+        print(f"No external data files found in the directory: {exfortables_directory}")
+        return
+
     if not external_files:
         print("No external data files selected based on score_dict.")
         return
@@ -215,7 +227,52 @@ plot '-' using 1:2 with linespoints title 'Chi-squared'
     return gnuplot_script
 
 
-def run_gnuplot(gnuplot_script_content, script_file):
+## Rendered plots are cached: "<plot>.png.sha256" holds the hash of the script
+## and of every data file it plots, and a plot is only rendered again when
+## that hash changes or the PNG is missing.
+
+
+def plot_output_file(gnuplot_script_content):
+    match = re.search(r"^set output '([^']+)'", gnuplot_script_content, re.MULTILINE)
+    return match.group(1) if match else None
+
+
+def plot_data_files(gnuplot_script_content):
+    ## '-' is inline data, already part of the script
+    return [
+        f
+        for f in re.findall(r"'([^']+)' using", gnuplot_script_content)
+        if f != "-"
+    ]
+
+
+def plot_hash(gnuplot_script_content):
+    digest = hashlib.sha256(gnuplot_script_content.encode())
+    for data_file in plot_data_files(gnuplot_script_content):
+        digest.update(data_file.encode())
+        if os.path.exists(data_file):
+            with open(data_file, "rb") as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+
+    return digest.hexdigest()
+
+
+def plot_is_stale(gnuplot_script_content):
+    plot_file = plot_output_file(gnuplot_script_content)
+    if plot_file is None or not os.path.exists(plot_file):
+        return True
+    if not os.path.exists(plot_file + ".sha256"):
+        return True
+
+    with open(plot_file + ".sha256") as f:
+        return f.read().strip() != plot_hash(gnuplot_script_content)
+
+
+def run_gnuplot(gnuplot_script_content, script_file, force=False):
+    ## returns False if the plot is up to date and was not rendered
+    if not force and not plot_is_stale(gnuplot_script_content):
+        return False
+
     with open(script_file, "w") as f:
         f.write(gnuplot_script_content)
 
@@ -225,3 +282,38 @@ def run_gnuplot(gnuplot_script_content, script_file):
         print("Gnuplot Error:", result.stderr)
     else:
         print("Gnuplot Output:", result.stdout)
+        plot_file = plot_output_file(gnuplot_script_content)
+        if plot_file is not None:
+            with open(plot_file + ".sha256", "w") as f:
+                f.write(plot_hash(gnuplot_script_content) + "\n")
+
+    return True
+
+
+def render_plots(gnuplot_scripts, n_workers=N, force=False):
+    ## gnuplot_scripts: [(script content, script file)], only stale plots are
+    ## rendered, in parallel
+    stale = [
+        (content, script_file)
+        for content, script_file in gnuplot_scripts
+        if force or plot_is_stale(content)
+    ]
+    print(f"{len(stale)} of {len(gnuplot_scripts)} plots to render")
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        futures = {
+            executor.submit(run_gnuplot, content, script_file, True): script_file
+            for content, script_file in stale
+        }
+
+    errors = []
+    for future, script_file in futures.items():
+        try:
+            future.result()
+        except Exception as e:
+            print(f"Could not render {script_file}: {e}")
+            errors.append(e)
+    if errors:
+        raise errors[0]
+
+    return [script_file for _, script_file in stale]
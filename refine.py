@@ -0,0 +1,163 @@
+import os
+
+import numpy as np
+
+from config import (
+    CALC_PATH,
+    TALYS_INP_FILE_NAME,
+    REFINE_TOLERANCE,
+    REFINE_MIN_STEP,
+    REFINE_MAX_LEVELS,
+    REFINE_ENERGY_FILE,
+    N,
+)
+from run_cache import load_run_cache, cached_run, input_hash
+from scheduler import run_jobs
+from xs_cube import reaction_name, residual_output_path, load_residual_output
+
+
+## Adaptive energy grid
+## Every job first runs on its coarse energy_range. Where linear interpolation
+## between neighbouring points misses the middle point by more than
+## REFINE_TOLERANCE of the residual's peak cross section, or where the cross
+## section rises from zero (threshold), the intervals are halved: one
+## follow-up run per job computes only the new midpoints (TALYS "energy
+## <file>"). After at most REFINE_MAX_LEVELS levels the points of all runs are
+## merged into one excitation function per residual, written as rp* files to
+## <calc_directory>_refined. The returned jobs point to those directories and
+## can be passed to update_chi_squared, the cross section cube or the plots;
+## the campaign itself keeps using the coarse runs.
+
+
+def refined_directory(job):
+    return job["calc_directory"] + "_refined"
+
+
+def refinement_energies(energy, cross_section, min_step=REFINE_MIN_STEP):
+    ## midpoints of the intervals to refine
+    if len(energy) < 2 or cross_section.max() <= 0:
+        return np.array([])
+
+    flagged = np.zeros(len(energy) - 1, dtype=bool)
+
+    ## interpolation error of every interior point from its neighbours
+    if len(energy) > 2:
+        linear = cross_section[:-2] + (cross_section[2:] - cross_section[:-2]) * (
+            energy[1:-1] - energy[:-2]
+        ) / (energy[2:] - energy[:-2])
+        error = np.abs(cross_section[1:-1] - linear) / cross_section.max()
+        flagged[:-1] |= error > REFINE_TOLERANCE
+        flagged[1:] |= error > REFINE_TOLERANCE
+
+    ## threshold: zero followed by a finite cross section
+    flagged |= (cross_section[:-1] <= 0) & (cross_section[1:] > 0)
+
+    width = np.diff(energy)
+    flagged &= width >= 2 * min_step
+    return (energy[:-1] + width / 2)[flagged]
+
+
+def merge_excitation_functions(functions):
+    ## points of several runs sorted by energy, the first run winning duplicates
+    data = np.concatenate([f for f in functions if f is not None])
+    energy = np.round(data[:, 0], 5)
+    _, first = np.unique(energy, return_index=True)
+    return data[first]
+
+
+def write_residual_output(rp_file, data):
+    os.makedirs(os.path.dirname(rp_file), exist_ok=True)
+    np.savetxt(
+        rp_file,
+        data,
+        fmt="%12.5e",
+        header="merged excitation function (adaptive energy grid)\nE xs",
+    )
+
+
+def follow_up_job(job, level, energies):
+    ## one directory per distinct input, so no other grid's output is reused
+    follow_up = dict(
+        job, energy_range=REFINE_ENERGY_FILE, energies=[float(e) for e in energies]
+    )
+    follow_up["name"] = f"{job['name']}_refine_{level}_{input_hash(follow_up)[:8]}"
+    follow_up["calc_directory"] = os.path.join(CALC_PATH, "refine", follow_up["name"])
+    follow_up["input_file"] = os.path.join(
+        follow_up["calc_directory"], TALYS_INP_FILE_NAME
+    )
+    return follow_up
+
+
+def run_missing(jobs, n_workers):
+    ## run the jobs without a cached run, return the run directory of each
+    run_cache = load_run_cache()
+    missing = [job for job in jobs if cached_run(run_cache, job) is None]
+    if missing:
+        run_jobs(missing, n_workers)
+        run_cache = load_run_cache()
+
+    return {job["name"]: cached_run(run_cache, job) for job in jobs}
+
+
+def refine_jobs(medical_isotope_reactions, jobs, n_workers=N):
+    ## the jobs with calc_directory set to the merged rp* files
+    residuals = {}
+    for input in medical_isotope_reactions:
+        residuals.setdefault(reaction_name(input), []).append(input["residual_nuclide"].name)
+
+    directories = run_missing(jobs, n_workers)
+    merged = {}
+    for job in jobs:
+        merged[job["name"]] = {
+            residual: load_residual_output(directories[job["name"]], residual)
+            if directories[job["name"]]
+            else None
+            for residual in residuals.get(reaction_name(job["input"]), [])
+        }
+
+    for level in range(1, REFINE_MAX_LEVELS + 1):
+        follow_ups = []
+        for job in jobs:
+            ## one run covers the new energies of all residuals of the target
+            energies = [
+                refinement_energies(data[:, 0], data[:, 1])
+                for data in merged[job["name"]].values()
+                if data is not None
+            ]
+            energies = np.unique(np.round(np.concatenate(energies or [[]]), 5))
+            if energies.size:
+                follow_ups.append((job, follow_up_job(job, level, energies)))
+
+        if not follow_ups:
+            break
+        print(
+            f"Refinement level {level}: {len(follow_ups)} runs, "
+            f"{sum(len(f['energies']) for _, f in follow_ups)} extra energies"
+        )
+
+        follow_up_directories = run_missing([f for _, f in follow_ups], n_workers)
+        for job, follow_up in follow_ups:
+            calc_directory = follow_up_directories[follow_up["name"]]
+            if calc_directory is None:
+                continue
+            for residual, data in merged[job["name"]].items():
+                new = load_residual_output(calc_directory, residual)
+                if data is None or new is None:
+                    continue
+                merged[job["name"]][residual] = merge_excitation_functions([data, new])
+
+    for job in jobs:
+        for residual, data in merged[job["name"]].items():
+            if data is not None:
+                write_residual_output(
+                    residual_output_path(refined_directory(job), residual), data
+                )
+
+    return [dict(job, calc_directory=refined_directory(job)) for job in jobs]
+
+
+if __name__ == "__main__":
+    from talys_jobs import get_IAEA_medical_isotope_nuclides, build_talys_jobs
+
+    medical_isotope_reactions = get_IAEA_medical_isotope_nuclides()
+    refine_jobs(medical_isotope_reactions, build_talys_jobs(medical_isotope_reactions))
@@ -0,0 +1,127 @@
+import os
+import json
+import shutil
+import hashlib
+from datetime import datetime
+
+from config import TALYS_PATH, CALC_PATH, RUN_CACHE_FILE
+from talys_jobs import run_status, run_input_text, written_input_text
+
+
+## Run cache
+## Finished TALYS runs are indexed by the SHA-256 of their talys.inp text and
+## of the TALYS binary that produced them, so a run with the same input is
+## found wherever it was computed (campaign, optimisation or sensitivity
+## directories) and never launched twice. Jobs run with another installation
+## than TALYS_PATH carry it as job["talys_path"].
+## CALC_PATH/run_cache.json:
+##     {"<input hash>-<binary id>": {"calc_directory", "name", "date"}}
+
+## binary ids by (path, size, mtime)
+_binary_ids = {}
+
+
+def input_hash(job):
+    ## jobs with an energy file (job["energies"]) differ only in its content
+    return hashlib.sha256(run_input_text(job).encode()).hexdigest()
+
+
+def holds_run(calc_directory, job):
+    ## finished run in the directory whose talys.inp is the job's input
+    if run_status({"calc_directory": calc_directory}) != "done":
+        return False
+    return written_input_text(calc_directory, job) == run_input_text(job)
+
+
+def talys_binary_id(talys_path=None):
+    ## first 16 hex digits of the SHA-256 of bin/talys, None if not installed
+    binary = os.path.join(talys_path or TALYS_PATH, "bin/talys")
+    try:
+        st = os.stat(binary)
+    except FileNotFoundError:
+        return None
+    key = (binary, st.st_size, st.st_mtime_ns)
+
+    if key not in _binary_ids:
+        digest = hashlib.sha256()
+        with open(binary, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        _binary_ids[key] = digest.hexdigest()[:16]
+
+    return _binary_ids[key]
+
+
+def run_key(job):
+    return f"{input_hash(job)}-{talys_binary_id(job.get('talys_path'))}"
+
+
+def run_cache_path():
+    return os.path.join(CALC_PATH, RUN_CACHE_FILE)
+
+
+def load_run_cache():
+    path = run_cache_path()
+    if not os.path.exists(path):
+        return {}
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_run_cache(cache):
+    os.makedirs(CALC_PATH, exist_ok=True)
+    with open(run_cache_path(), "w") as f:
+        json.dump(cache, f, indent=1)
+
+
+def register_run(cache, job, calc_directory=None):
+    cache[run_key(job)] = {
+        "calc_directory": calc_directory or job["calc_directory"],
+        "name": job["name"],
+        "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def cached_run(cache, job, directory=True):
+    ## directory of a finished run with the same input and binary, None if
+    ## there is none. A run directory that is not in the cache (computed
+    ## before it existed) counts if its talys.inp is the job's input, unless
+    ## directory is False.
+    key = run_key(job)
+    entry = cache.get(key)
+    if entry is not None and holds_run(entry["calc_directory"], job):
+        return entry["calc_directory"]
+
+    if not directory or not holds_run(job["calc_directory"], job):
+        return None
+    ## registered for another binary
+    if any(
+        other["calc_directory"] == job["calc_directory"] and other_key != key
+        for other_key, other in cache.items()
+    ):
+        return None
+    return job["calc_directory"]
+
+
+def restore_cached_run(job, calc_directory):
+    ## replace the job's directory by a copy of a cached run
+    shutil.rmtree(job["calc_directory"], ignore_errors=True)
+    shutil.copytree(calc_directory, job["calc_directory"])
+
+
+def restore_cached_runs(jobs):
+    ## (jobs without a cached run, jobs restored from a run elsewhere); jobs
+    ## whose own directory holds the run are in neither
+    run_cache = load_run_cache()
+    to_run = []
+    restored = []
+    for job in jobs:
+        calc_directory = cached_run(run_cache, job)
+        if calc_directory is None:
+            to_run.append(job)
+        elif calc_directory != job["calc_directory"]:
+            restore_cached_run(job, calc_directory)
+            restored.append(job)
+
+    return to_run, restored
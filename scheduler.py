@@ -0,0 +1,580 @@
+import os
+import json
+import time
+import heapq
+import shutil
+import signal
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from subprocess import TimeoutExpired
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+from config import (
+    CALC_PATH,
+    TALYS_INP_FILE_NAME,
+    RUNTIME_HISTORY_FILE,
+    N,
+    TIMEOUT_FACTOR,
+    TIMEOUT_MIN,
+    TIMEOUT_DEFAULT,
+    MAX_RETRIES,
+    SPECULATIVE,
+    SPECULATIVE_FACTOR,
+    SPECULATIVE_CHECK_INTERVAL,
+    MEMORY_BUDGET,
+    DISK_BUDGET,
+    QUEUE_POLL_INTERVAL,
+    PREEMPT,
+)
+from elem import ELEM_TO_Z
+from run_cache import load_run_cache, save_run_cache, register_run, cached_run
+from job_queue import register_scheduler, unregister_scheduler, collect_submitted
+from talys_modules import (
+    create_talys_inp,
+    run_talys,
+    has_residual_output,
+    directory_size,
+    write_energy_file,
+    paused_time,
+)
+
+
+## seconds per (nucleon x incident energy) used until enough history exists
+DEFAULT_SECONDS_PER_UNIT = 0.5
+
+
+def count_energies(energy_range):
+    ## energy_range is the TALYS keyword value, e.g. "5.0 45.0 1.0"
+    emin, emax, estep = [float(e) for e in energy_range.split()]
+    if estep <= 0:
+        return 1
+    return int((emax - emin) / estep + 1e-9) + 1
+
+
+def describe_job(job):
+    ## flat description of a job, also the format stored in the history
+    inputs = job["input"]
+    parameters = job["parameters"]
+    return {
+        "name": job["name"],
+        "projectile": inputs["projectile"],
+        "element": inputs["element"],
+        "mass": int(inputs["mass"]),
+        "n_energies": len(job["energies"])
+        if "energies" in job
+        else count_energies(job["energy_range"]),
+        "ldmodel": parameters.get("ldmodel"),
+        "colenhance": parameters.get("colenhance"),
+    }
+
+
+def job_features(record):
+    ## natural targets (mass 0) run every stable isotope, so estimate the
+    ## effective mass from Z and flag them separately
+    z = ELEM_TO_Z.get(record["element"].capitalize(), 0)
+    mass = record["mass"] if record["mass"] else round(2.2 * z)
+    natural = 0.0 if record["mass"] else 1.0
+    n_energies = record["n_energies"]
+
+    return [
+        1.0,
+        mass,
+        n_energies,
+        mass * n_energies,
+        natural * n_energies,
+        float(record["ldmodel"] or 0),
+        1.0 if record["colenhance"] == "y" else 0.0,
+    ]
+
+
+def runtime_history_path():
+    return os.path.join(CALC_PATH, RUNTIME_HISTORY_FILE)
+
+
+def load_runtime_history():
+    history = []
+    path = runtime_history_path()
+    if not os.path.exists(path):
+        return history
+
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                history.append(json.loads(line))
+            except ValueError:
+                print(f"Skipping broken line in {path}: {line.strip()}")
+    return history
+
+
+def record_runtime(record):
+    os.makedirs(CALC_PATH, exist_ok=True)
+    with open(runtime_history_path(), "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+def fit_cost_model(history, quantity="runtime"):
+    ## least-squares fit of the run time (or peak_rss, output_size) to the
+    ## job features, None if the history is too short to constrain the model
+    rows = [r for r in history if r.get("returncode") == 0 and r.get(quantity)]
+    if not rows:
+        return None
+
+    x = np.array([job_features(r) for r in rows])
+    y = np.array([r[quantity] for r in rows])
+    if len(rows) < 2 * x.shape[1]:
+        return None
+
+    coefficients, _, _, _ = np.linalg.lstsq(x, y, rcond=None)
+
+    return coefficients
+
+
+def predict_runtime(record, coefficients):
+    features = job_features(record)
+    if coefficients is None:
+        ## mass * n_energies
+        return DEFAULT_SECONDS_PER_UNIT * features[3]
+
+    return max(float(np.dot(features, coefficients)), 1.0)
+
+
+def predict_resource(record, coefficients, history, quantity):
+    ## without a model, assume the largest value seen so far (0 if none)
+    if coefficients is None:
+        return max((r.get(quantity) or 0.0 for r in history), default=0.0)
+
+    return max(float(np.dot(job_features(record), coefficients)), 0.0)
+
+
+def estimate_makespan(runtimes, n_workers):
+    ## simulate list scheduling: each job goes to the first free worker
+    workers = [0.0] * max(n_workers, 1)
+    for runtime in runtimes:
+        start = heapq.heappop(workers)
+        heapq.heappush(workers, start + runtime)
+    return max(workers)
+
+
+def order_jobs(jobs, coefficients, history=()):
+    ## longest processing time first
+    memory_model = fit_cost_model(history, "peak_rss")
+    disk_model = fit_cost_model(history, "output_size")
+
+    for job in jobs:
+        record = describe_job(job)
+        job["expected_runtime"] = predict_runtime(record, coefficients)
+        job["expected_memory"] = predict_resource(record, memory_model, history, "peak_rss")
+        job["expected_disk"] = predict_resource(record, disk_model, history, "output_size")
+        ## without a fitted model the expectation is too rough to kill runs or
+        ## launch duplicates on, only hung runs are killed
+        job["fitted"] = coefficients is not None
+        job["timeout"] = (
+            max(TIMEOUT_MIN, TIMEOUT_FACTOR * job["expected_runtime"])
+            if job["fitted"]
+            else TIMEOUT_DEFAULT
+        )
+
+    return sorted(jobs, key=lambda job: job["expected_runtime"], reverse=True)
+
+
+def admissible(pending, running, written):
+    ## index of the first pending job that fits the budgets, or the budget
+    ## ("memory" or "disk") that keeps all of them waiting
+    memory = sum(task["job"]["expected_memory"] for task in running.values())
+    disk = written + sum(task["job"]["expected_disk"] for task in running.values())
+
+    limit = None
+    for k, job in enumerate(pending):
+        if MEMORY_BUDGET is not None and running and memory + job["expected_memory"] > MEMORY_BUDGET:
+            limit = limit or "memory"
+            continue
+        if DISK_BUDGET is not None and disk + job["expected_disk"] > DISK_BUDGET:
+            limit = limit or "disk"
+            continue
+        return k, None
+
+    return None, limit
+
+
+def execute_job(job, calc_directory, cancel, usage):
+    ## status: "ok", "failed" (non-zero exit or no rp* files), "timeout" or
+    ## "cancelled" (killed because another copy of the job won)
+    os.makedirs(calc_directory, exist_ok=True)
+    input_file = os.path.join(calc_directory, TALYS_INP_FILE_NAME)
+    create_talys_inp(input_file, job["input"], job["energy_range"], job["parameters"])
+    if "energies" in job:
+        ## energy_range is then the name of this file
+        write_energy_file(os.path.join(calc_directory, job["energy_range"]), job["energies"])
+
+    start = time.time()
+    try:
+        returncode = run_talys(
+            input_file,
+            calc_directory,
+            job["timeout"],
+            cancel,
+            usage,
+            job.get("talys_path"),
+        )
+    except TimeoutExpired:
+        returncode = None
+        status = "timeout"
+    else:
+        if returncode is None:
+            status = "cancelled"
+        elif returncode != 0 or not has_residual_output(calc_directory):
+            status = "failed"
+        else:
+            status = "ok"
+
+    return {
+        "status": status,
+        "returncode": returncode,
+        ## time stopped for the interactive lane is not runtime
+        "runtime": time.time() - start - paused_time(usage),
+        "peak_rss": usage.get("peak_rss"),
+        "output_size": directory_size(calc_directory),
+    }
+
+
+def launch(executor, job, speculative=False):
+    calc_directory = job["calc_directory"]
+    if speculative:
+        calc_directory += "_spec"
+        shutil.rmtree(calc_directory, ignore_errors=True)
+
+    task = {
+        "job": job,
+        "calc_directory": calc_directory,
+        "speculative": speculative,
+        "cancel": threading.Event(),
+        "started": time.time(),
+        ## pid of the TALYS process, peak memory and time spent paused
+        "usage": {"paused": 0.0},
+    }
+    future = executor.submit(
+        execute_job, job, calc_directory, task["cancel"], task["usage"]
+    )
+    return future, task
+
+
+## Priority lanes
+## Jobs of the interactive lane are queued ahead of the campaign lane. With
+## PREEMPT, a campaign TALYS process is stopped (SIGSTOP) while interactive
+## jobs wait for a worker and continued (SIGCONT) once none are left; time
+## spent stopped does not count towards the watchdog timeout.
+
+
+def insert_after_interactive(pending, job):
+    ## behind the interactive jobs already waiting
+    k = 0
+    while k < len(pending) and pending[k]["lane"] == "interactive":
+        k += 1
+    pending.insert(k, job)
+
+
+def active_tasks(running):
+    return [task for task in running.values() if "paused_at" not in task["usage"]]
+
+
+def pause_task(running):
+    ## stop the campaign run started last, False if none can be stopped
+    candidates = [
+        task
+        for task in active_tasks(running)
+        if task["job"]["lane"] == "campaign" and "pid" in task["usage"]
+    ]
+    if not candidates:
+        return False
+
+    task = max(candidates, key=lambda task: task["started"])
+    try:
+        os.kill(task["usage"]["pid"], signal.SIGSTOP)
+    except ProcessLookupError:
+        return False
+    task["usage"]["paused_at"] = time.time()
+    print(f"{task['job']['name']} paused for an interactive run")
+    return True
+
+
+def resume_task(running):
+    paused = [task for task in running.values() if "paused_at" in task["usage"]]
+    if not paused:
+        return False
+
+    task = min(paused, key=lambda task: task["usage"]["paused_at"])
+    try:
+        os.kill(task["usage"]["pid"], signal.SIGCONT)
+    except ProcessLookupError:
+        pass
+    task["usage"]["paused"] += time.time() - task["usage"].pop("paused_at")
+    print(f"{task['job']['name']} resumed")
+    return True
+
+
+def report_queue_wait(waits):
+    for lane, values in waits.items():
+        if values:
+            print(
+                f"{lane.capitalize()} lane: {len(values)} runs, queue wait "
+                f"mean {sum(values) / len(values):.1f} s, max {max(values):.1f} s"
+            )
+
+
+def find_straggler(running):
+    ## the slowest run (relative to its expectation) without a duplicate yet
+    copies = {}
+    for task in running.values():
+        copies[task["job"]["name"]] = copies.get(task["job"]["name"], 0) + 1
+
+    now = time.time()
+    ## stopped runs are behind because of the interactive lane
+    stragglers = [
+        task
+        for task in active_tasks(running)
+        if copies[task["job"]["name"]] == 1
+        and task["job"]["fitted"]
+        and now - task["started"] > SPECULATIVE_FACTOR * task["job"]["expected_runtime"]
+    ]
+    if not stragglers:
+        return None
+
+    return max(
+        stragglers,
+        key=lambda task: (now - task["started"]) / task["job"]["expected_runtime"],
+    )["job"]
+
+
+def promote_speculative(job):
+    ## the duplicate won: its directory replaces the original one
+    shutil.rmtree(job["calc_directory"], ignore_errors=True)
+    shutil.move(job["calc_directory"] + "_spec", job["calc_directory"])
+
+
+def estimate_cost(jobs, n_workers=N):
+    ## jobs in launch order and the predicted CPU time, wall time (s) and
+    ## output (MB) from the runtime history, without running anything
+    history = load_runtime_history()
+    coefficients = fit_cost_model(history)
+    jobs = order_jobs(jobs, coefficients, history)
+
+    estimate = {
+        "runs": len(jobs),
+        "model": "fitted" if coefficients is not None else "default",
+        "cpu_time": sum(job["expected_runtime"] for job in jobs),
+        "wall_time": estimate_makespan(
+            [job["expected_runtime"] for job in jobs], n_workers
+        ),
+        "disk": sum(job["expected_disk"] for job in jobs),
+        ## the n_workers largest runs at once
+        "memory": sum(
+            sorted((job["expected_memory"] for job in jobs), reverse=True)[:n_workers]
+        ),
+    }
+    return jobs, estimate
+
+
+def plan_jobs(jobs, n_workers=N, force=False):
+    ## dry run: the jobs without a cached run and their estimated cost
+    run_cache = load_run_cache()
+    to_run = [job for job in jobs if force or cached_run(run_cache, job) is None]
+    to_run, estimate = estimate_cost(to_run, n_workers)
+    estimate["cached"] = len(jobs) - len(to_run)
+
+    print(
+        f"{len(to_run)} of {len(jobs)} TALYS runs to launch ({estimate['cached']} cached), "
+        f"{estimate['model']} cost model:\n"
+        f"  CPU time   {estimate['cpu_time'] / 3600.0:.2f} h\n"
+        f"  wall time  {estimate['wall_time'] / 3600.0:.2f} h on {n_workers} workers\n"
+        f"  disk       {estimate['disk'] / 1024.0:.2f} GB\n"
+        f"  memory     {estimate['memory'] / 1024.0:.2f} GB at peak"
+    )
+    return to_run, estimate
+
+
+def run_jobs(jobs, n_workers=N):
+    ## jobs without a "lane" run in the campaign lane
+    start = time.time()
+    for job in jobs:
+        job.setdefault("lane", "campaign")
+        job.setdefault("queued", start)
+
+    jobs, estimate = estimate_cost(jobs, n_workers)
+    completion = datetime.now() + timedelta(seconds=estimate["wall_time"])
+    print(
+        f"{len(jobs)} TALYS runs on {n_workers} workers ({estimate['model']} cost model): "
+        f"{estimate['cpu_time'] / 3600.0:.2f} CPU-hours, "
+        f"estimated completion at {completion:%Y-%m-%d %H:%M}"
+    )
+    run_cache = load_run_cache()
+    history = load_runtime_history()
+    coefficients = fit_cost_model(history)
+    if MEMORY_BUDGET is not None and not any(r.get("peak_rss") for r in history):
+        print(
+            "Warning: no memory usage measured in past runs yet, "
+            "the memory budget is not enforced"
+        )
+
+    pending = deque(
+        [job for job in jobs if job["lane"] == "interactive"]
+        + [job for job in jobs if job["lane"] == "campaign"]
+    )
+    running = {}
+    attempts = {job["name"]: 0 for job in jobs}
+    results = {}
+    waits = {"interactive": [], "campaign": []}
+
+    ## MB written by finished runs, seconds a budget kept workers idle
+    written = 0.0
+    limited = {"memory": 0.0, "disk": 0.0}
+    limit = None
+    last = time.time()
+
+    register_scheduler()
+    ## stopped runs keep their thread
+    executor = ThreadPoolExecutor(max_workers=2 * n_workers if PREEMPT else n_workers)
+    try:
+        while pending or running:
+            now = time.time()
+            if limit is not None:
+                limited[limit] += now - last
+            last = now
+
+            for job in order_jobs(collect_submitted(), coefficients, history):
+                if cached_run(run_cache, job) is not None:
+                    print(f"{job['name']} was already computed in {cached_run(run_cache, job)}")
+                    continue
+                print(f"{job['name']} queued in the interactive lane")
+                attempts[job["name"]] = 0
+                insert_after_interactive(pending, job)
+
+            interactive = bool(pending) and pending[0]["lane"] == "interactive"
+            if PREEMPT:
+                if interactive and len(active_tasks(running)) >= n_workers:
+                    pause_task(running)
+                elif not interactive and len(active_tasks(running)) < n_workers:
+                    resume_task(running)
+
+            previous, limit = limit, None
+            while pending and len(active_tasks(running)) < n_workers:
+                k, limit = admissible(pending, running, written)
+                if k is None:
+                    break
+                job = pending[k]
+                del pending[k]
+                if "queued" in job:
+                    waits[job["lane"]].append(time.time() - job.pop("queued"))
+                future, task = launch(executor, job)
+                running[future] = task
+
+            if limit is not None and previous is None:
+                print(
+                    f"{limit.capitalize()} budget reached: {len(running)} of "
+                    f"{n_workers} workers busy, {len(pending)} waiting"
+                )
+            if limit is not None and not running:
+                print(f"No run fits the {limit} budget, {len(pending)} runs not started")
+                for job in pending:
+                    results[job["name"]] = {"status": "not started"}
+                break
+
+            if SPECULATIVE and not pending and len(active_tasks(running)) < n_workers:
+                straggler = find_straggler(running)
+                ## a duplicate needs its own share of the budgets
+                if straggler is not None and admissible([straggler], running, written)[0] is not None:
+                    print(f"{straggler['name']} is straggling, launching a duplicate")
+                    future, task = launch(executor, straggler, speculative=True)
+                    running[future] = task
+
+            done, _ = wait(
+                running,
+                timeout=min(SPECULATIVE_CHECK_INTERVAL, QUEUE_POLL_INTERVAL),
+                return_when=FIRST_COMPLETED,
+            )
+            for future in done:
+                task = running.pop(future)
+                job = task["job"]
+                result = future.result()
+
+                if result["status"] == "cancelled" or job["name"] in results:
+                    continue
+
+                record = describe_job(job)
+                record["lane"] = job["lane"]
+                record.update(result)
+                record["date"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                record_runtime(record)
+                written += result["output_size"]
+
+                others = [f for f, t in running.items() if t["job"] is job]
+
+                if result["status"] == "ok":
+                    ## first successful copy wins, the others are killed
+                    for other in others:
+                        running[other]["cancel"].set()
+                        other.result()
+                        if running.pop(other)["speculative"]:
+                            shutil.rmtree(job["calc_directory"] + "_spec", ignore_errors=True)
+                    if task["speculative"]:
+                        promote_speculative(job)
+                    register_run(run_cache, job)
+                    save_run_cache(run_cache)
+
+                    results[job["name"]] = result
+                    print(
+                        f"{job['name']} finished in {result['runtime']:.1f} s "
+                        f"(expected {job['expected_runtime']:.1f} s), "
+                        f"{len(pending)} waiting"
+                    )
+                    continue
+
+                print(f"{job['name']}: TALYS run {result['status']} ({task['calc_directory']})")
+                if others:
+                    ## another copy is still running
+                    continue
+
+                if attempts[job["name"]] < MAX_RETRIES:
+                    attempts[job["name"]] += 1
+                    print(f"Retrying {job['name']} ({attempts[job['name']]}/{MAX_RETRIES})")
+                    if job["lane"] == "interactive":
+                        pending.appendleft(job)
+                    else:
+                        insert_after_interactive(pending, job)
+                else:
+                    results[job["name"]] = result
+    finally:
+        ## after an error, kill the runs still going; a stopped process only
+        ## dies once continued
+        for task in running.values():
+            if "paused_at" in task["usage"]:
+                try:
+                    os.kill(task["usage"]["pid"], signal.SIGCONT)
+                except ProcessLookupError:
+                    pass
+            task["cancel"].set()
+        executor.shutdown()
+        unregister_scheduler()
+
+    report_queue_wait(waits)
+
+    failed = [
+        name
+        for name, result in results.items()
+        if result["status"] not in ("ok", "not started")
+    ]
+    if failed:
+        print(f"{len(failed)} TALYS runs failed: {', '.join(failed)}")
+
+    for budget, seconds in limited.items():
+        if seconds > 0:
+            print(
+                f"The {budget} budget rather than the number of workers limited "
+                f"throughput for {seconds / 60.0:.1f} min"
+            )
+
+    return results
@@ -0,0 +1,178 @@
+import os
+import json
+
+import numpy as np
+
+from config import (
+    CALC_PATH,
+    TALYS_INP_FILE_NAME,
+    ENERGY_RANGE_MIN,
+    ENERGY_RANGE_MAX,
+    ENERGY_STEP,
+    N,
+    SENSITIVITY_PARAMETERS,
+    SENSITIVITY_STEP,
+    SENSITIVITY_THRESHOLD,
+)
+from scheduler import run_jobs
+from xs_cube import reaction_name, load_residual_output
+
+
+## Finite-difference sensitivity of the residual cross sections to the TALYS
+## adjustment parameters. For every target the central run (all adjustments
+## at 1.0) and one run per parameter at 1.0 + SENSITIVITY_STEP are launched
+## as one batch. The result per reaction is a Jacobian of shape
+## (residual, parameter, energy) in mb per unit parameter, stored as .npz
+## under CALC_PATH/sensitivity.
+
+
+def sensitivity_directory():
+    return os.path.join(CALC_PATH, "sensitivity")
+
+
+def sensitivity_file(reaction):
+    return os.path.join(sensitivity_directory(), f"{reaction}.npz")
+
+
+def adjust_parameters(projectile, target, residuals):
+    ## global adjustments plus gadjust of the compound nucleus, the target and
+    ## the residuals (not for natural targets, which have no single compound)
+    keywords = list(SENSITIVITY_PARAMETERS)
+    if target.natural:
+        return keywords
+
+    ## compound nucleus: target + projectile, no outgoing particle
+    compound = target.ground_state.residual(projectile)
+    for nuclide in [compound, target] + residuals:
+        keyword = f"gadjust {nuclide.z} {nuclide.a}"
+        if keyword not in keywords:
+            keywords.append(keyword)
+
+    return keywords
+
+
+def build_sensitivity_jobs(input, residuals, base_parameters, energy_range):
+    ## job 0 is the central run, job k perturbs parameter k - 1
+    projectile = input["projectile"]
+    target = input["target_nuclide"]
+    keywords = adjust_parameters(projectile, target, [r.ground_state for r in residuals])
+
+    central = dict(base_parameters)
+    central.update({keyword: 1.0 for keyword in keywords})
+
+    jobs = []
+    for k in range(len(keywords) + 1):
+        parameters = dict(central)
+        if k > 0:
+            parameters[keywords[k - 1]] = 1.0 + SENSITIVITY_STEP
+
+        name = f"{reaction_name(input)}_sensitivity_{k}"
+        calc_directory = os.path.join(sensitivity_directory(), name)
+        jobs.append(
+            {
+                "name": name,
+                "input": input,
+                "case": k,
+                "parameters": parameters,
+                "energy_range": energy_range,
+                "calc_directory": calc_directory,
+                "input_file": os.path.join(calc_directory, TALYS_INP_FILE_NAME),
+            }
+        )
+
+    return keywords, jobs
+
+
+def finite_difference_jacobian(jobs, residuals, energies):
+    ## (residual, parameter, energy), NaN where a run has no output
+    cross_sections = np.full((len(residuals), len(jobs), len(energies)), np.nan)
+    for k, job in enumerate(jobs):
+        for j, residual in enumerate(residuals):
+            data = load_residual_output(job["calc_directory"], residual.name)
+            if data is not None:
+                cross_sections[j, k] = np.interp(
+                    energies, data[:, 0], data[:, 1], left=np.nan, right=np.nan
+                )
+
+    central = cross_sections[:, :1, :]
+    jacobian = (cross_sections[:, 1:, :] - central) / SENSITIVITY_STEP
+
+    return central[:, 0, :], jacobian
+
+
+def relative_sensitivity(central, jacobian):
+    ## max over energies of |d(ln xs) / d(ln p)| per (residual, parameter)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        relative = np.abs(jacobian / central[:, None, :])
+
+    relative = np.where(np.isfinite(relative), relative, -np.inf).max(axis=2)
+    return np.where(np.isfinite(relative), relative, np.nan)
+
+
+def run_sensitivity(medical_isotope_reactions, base_parameters, n_workers=N):
+    energy_range = f"{ENERGY_RANGE_MIN} {ENERGY_RANGE_MAX} {ENERGY_STEP}"
+    energies = np.arange(ENERGY_RANGE_MIN, ENERGY_RANGE_MAX + 1e-9, ENERGY_STEP)
+    os.makedirs(sensitivity_directory(), exist_ok=True)
+
+    ## residuals of the same target share the runs
+    targets = {}
+    for input in medical_isotope_reactions:
+        reaction = reaction_name(input)
+        if reaction not in targets:
+            targets[reaction] = (input, [])
+        targets[reaction][1].append(input["residual_nuclide"])
+
+    summary = {}
+    for reaction, (input, residuals) in targets.items():
+        keywords, jobs = build_sensitivity_jobs(
+            input, residuals, base_parameters, energy_range
+        )
+        print(f"{reaction}: sensitivity to {len(keywords)} parameters")
+        run_jobs(jobs, n_workers)
+
+        central, jacobian = finite_difference_jacobian(jobs, residuals, energies)
+        relative = relative_sensitivity(central, jacobian)
+
+        np.savez(
+            sensitivity_file(reaction),
+            energies=energies,
+            parameters=np.array(keywords),
+            residuals=np.array([r.name for r in residuals]),
+            central=central,
+            jacobian=jacobian,
+            relative=relative,
+        )
+
+        for j, residual in enumerate(residuals):
+            summary[f"{reaction} {residual.name}"] = {
+                keyword: None if np.isnan(relative[j, p]) else float(relative[j, p])
+                for p, keyword in enumerate(keywords)
+            }
+
+    with open(os.path.join(sensitivity_directory(), "summary.json"), "w") as f:
+        json.dump(summary, f, indent=1)
+
+    return summary
+
+
+def load_sensitivity(reaction):
+    data = np.load(sensitivity_file(reaction))
+    return {key: data[key] for key in data.files}
+
+
+def sensitive_parameters(reaction, residual, threshold=SENSITIVITY_THRESHOLD):
+    ## parameters worth fitting for the residual; insensitive ones are dropped
+    data = load_sensitivity(reaction)
+    j = list(data["residuals"]).index(residual)
+
+    return [
+        str(keyword)
+        for keyword, relative in zip(data["parameters"], data["relative"][j])
+        if relative >= threshold
+    ]
+
+
+if __name__ == "__main__":
+    from talys_jobs import get_IAEA_medical_isotope_nuclides, parameter_check_cases
+
+    run_sensitivity(get_IAEA_medical_isotope_nuclides(), parameter_check_cases[0])
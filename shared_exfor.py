@@ -0,0 +1,82 @@
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from config import N
+
+
+## The EXFOR datasets to score are packed once into a single shared-memory
+## block of shape (3, points): energy, cross section and uncertainty. The
+## workers of dataset_pool attach it on start-up and read the arrays without
+## copying; a task carries only the block name, the dataset key and the
+## simulations, e.g.
+##     with dataset_pool(datasets) as (executor, name):
+##         executor.submit(shared_task, nominal_chi_squared, name, key, simulations)
+
+## datasets of the block attached in this process, by block name
+_attached = {}
+
+
+def share_datasets(datasets):
+    ## datasets: {key: [(energy, cross_section, delta_cross), ...]}
+    ## returns the shared block (close and unlink it when done) and its handle
+    total = sum(len(d[0]) for sets in datasets.values() for d in sets)
+    shm = shared_memory.SharedMemory(create=True, size=max(3 * total, 1) * 8)
+    block = np.ndarray((3, total), dtype=np.float64, buffer=shm.buf)
+
+    index = {}
+    start = 0
+    for key, sets in datasets.items():
+        index[key] = []
+        for energy, cross_section, delta_cross in sets:
+            stop = start + len(energy)
+            block[:, start:stop] = (energy, cross_section, delta_cross)
+            index[key].append((start, stop))
+            start = stop
+
+    handle = {"name": shm.name, "shape": (3, total), "index": index}
+    return shm, handle
+
+
+def attach_datasets(handle):
+    ## zero-copy views of the datasets in the shared block
+    if handle["name"] in _attached:
+        return _attached[handle["name"]][1]
+
+    try:
+        shm = shared_memory.SharedMemory(name=handle["name"], track=False)
+    except TypeError:
+        ## Python < 3.13: pool workers share the creator's resource tracker,
+        ## which only unlinks the block once
+        shm = shared_memory.SharedMemory(name=handle["name"])
+
+    block = np.ndarray(handle["shape"], dtype=np.float64, buffer=shm.buf)
+    datasets = {
+        key: [tuple(block[:, start:stop]) for start, stop in ranges]
+        for key, ranges in handle["index"].items()
+    }
+    _attached[handle["name"]] = (shm, datasets)
+
+    return datasets
+
+
+def shared_task(function, name, key, *args):
+    ## runs in a worker attached by the pool initializer:
+    ## function(datasets of key, *args)
+    return function(_attached[name][1][key], *args)
+
+
+@contextmanager
+def dataset_pool(datasets, n_workers=N):
+    ## (process pool attached to the shared datasets, block name)
+    shm, handle = share_datasets(datasets)
+    try:
+        with ProcessPoolExecutor(
+            max_workers=n_workers, initializer=attach_datasets, initargs=(handle,)
+        ) as executor:
+            yield executor, handle["name"]
+    finally:
+        shm.close()
+        shm.unlink()
@@ -0,0 +1,163 @@
+import os
+
+from config import (
+    TALYS_INP_FILE_NAME,
+    IAEA_MEDICAL_LIST,
+    CALC_PATH,
+    ENERGY_RANGE_MIN,
+    ENERGY_RANGE_MAX,
+    ENERGY_STEP,
+)
+from nuclide import nuclides
+from talys_modules import talys_input_text
+from utils import split_by_number
+
+
+## Reaction list and TALYS job definitions. Kept free of NumPy and the
+## plotting/scheduling modules so that planning and status checks start fast.
+
+
+parameter_check_cases = [
+    {"ldmodel": 1, "colenhance": "n"},
+    {"ldmodel": 1, "colenhance": "y"},
+    {"ldmodel": 2, "colenhance": "n"},
+    {"ldmodel": 2, "colenhance": "y"},
+    {"ldmodel": 5, "colenhance": "n"},
+]
+
+
+def frange(start, stop, step):
+    while start <= stop:
+        yield start
+        start += step
+
+
+def get_IAEA_medical_isotope_nuclides(path=IAEA_MEDICAL_LIST) -> list:
+    # format
+    # Br000	p	X	Se072
+    medical_reactions = []
+
+    f = open(path, "r")
+    lines = [line.split() for line in f.readlines() if line.strip()]
+
+    ## interned, so repeated targets/residuals share one Nuclide
+    targets = nuclides([l[0] for l in lines])
+    residuals = nuclides([l[3] for l in lines])
+
+    for l, target_nuclide, residual_nuclide in zip(lines, targets, residuals):
+        projectile = l[1]
+        target = split_by_number( l[0] )
+        residual = split_by_number( l[3] )
+
+        medical_reactions += [ {"projectile": projectile, "element": target[0], "mass": target[1], "target": target, "residual": residual, "target_nuclide": target_nuclide, "residual_nuclide": residual_nuclide} ]
+
+    return medical_reactions
+
+
+def build_talys_jobs(medical_isotope_reactions, cases=None, energy_range=None):
+    ## one TALYS run per target and parameter case; several residuals
+    ## of the same target share the run
+    cases = cases or parameter_check_cases
+    energy_range = energy_range or f"{ENERGY_RANGE_MIN} {ENERGY_RANGE_MAX} {ENERGY_STEP}"
+    jobs = {}
+
+    for input in medical_isotope_reactions:
+        projectile = input["projectile"]
+        element = input["element"]
+        mass = int(input["mass"])
+
+        for i in range(len(cases)):
+            name = f"{projectile}-{element}{mass}_chisquared_{i}"
+            if name in jobs:
+                continue
+
+            calc_directory = os.path.join(CALC_PATH, name)
+            jobs[name] = {
+                "name": name,
+                "input": input,
+                "case": i,
+                "parameters": cases[i],
+                "energy_range": energy_range,
+                "calc_directory": calc_directory,
+                "input_file": os.path.join(calc_directory, TALYS_INP_FILE_NAME),
+            }
+
+    return list(jobs.values())
+
+
+def reaction_name(input):
+    return f"{input['projectile']}-{input['target_nuclide'].name}"
+
+
+def residual_name(input):
+    return input["residual_nuclide"].name
+
+
+def select_reactions(medical_isotope_reactions, reactions=None):
+    ## "p-Cd111" (all residuals), "p-Cd111 In111" or a list of those;
+    ## None selects everything
+    if reactions is None:
+        return medical_isotope_reactions
+    if isinstance(reactions, str):
+        reactions = [reactions]
+
+    wanted = set(reactions)
+    return [
+        input
+        for input in medical_isotope_reactions
+        if reaction_name(input) in wanted
+        or f"{reaction_name(input)} {residual_name(input)}" in wanted
+    ]
+
+
+def select_reaction(medical_isotope_reactions, reaction):
+    ## the one reaction and residual matching e.g. "p-Cd111 In111"
+    selected = select_reactions(medical_isotope_reactions, reaction)
+    if not selected:
+        raise ValueError(f"No reaction matches {reaction}")
+    if len(selected) > 1:
+        raise ValueError(
+            f"{reaction} matches {len(selected)} reactions, choose one of: "
+            + ", ".join(f"{reaction_name(input)} {residual_name(input)}" for input in selected)
+        )
+    return selected[0]
+
+
+def run_input_text(job):
+    ## talys.inp of the job, followed by its energy file if it has one
+    text = talys_input_text(job["input"], job["energy_range"], job["parameters"])
+    if "energies" in job:
+        text += "".join(f"{energy:.5f}\n" for energy in job["energies"])
+    return text
+
+
+def written_input_text(calc_directory, job):
+    ## the same for the files in a run directory, None if missing
+    try:
+        with open(os.path.join(calc_directory, TALYS_INP_FILE_NAME)) as f:
+            text = f.read()
+        if "energies" in job:
+            with open(os.path.join(calc_directory, job["energy_range"])) as f:
+                text += f.read()
+    except FileNotFoundError:
+        return None
+    return text
+
+
+def run_status(job):
+    ## "done" (rp* files present), "stale" (rp* files of another input than
+    ## the job's), "failed" (TALYS output without rp* files) or "pending";
+    ## without job["input"] only the files are checked
+    try:
+        files = os.listdir(job["calc_directory"])
+    except FileNotFoundError:
+        return "pending"
+
+    if any(f.startswith("rp") for f in files):
+        written = written_input_text(job["calc_directory"], job)
+        if "input" in job and written != run_input_text(job):
+            return "stale"
+        return "done"
+    if "output.txt" in files:
+        return "failed"
+    return "pending"
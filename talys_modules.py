@@ -1,56 +1,148 @@
 import os
-from subprocess import Popen, PIPE
+import re
+import time
+from subprocess import Popen, PIPE, TimeoutExpired, run, CalledProcessError
 from glob import glob
 
-from config import TALYS_PATH, N
+from config import TALYS_PATH, N, WATCHDOG_POLL_INTERVAL
+
+
+def talys_input_text(inputs, energy_range, parameters):
+    projectile = inputs.get("projectile")
+    element = inputs.get("element")
+    mass = inputs.get("mass")
+
+    ldmodel = parameters.get("ldmodel")
+    colenhance = parameters.get("colenhance")
+
+    lines = [
+        "#",
+        f"#  {projectile}-{element}",
+        "#",
+        "# General",
+        "#",
+        f"projectile {projectile}",
+        f"element {element}",
+        f"mass {mass}",
+        f"energy {energy_range}",
+        "#",
+        "# Parameters",
+        "#",
+        f"ldmodel {ldmodel}",
+        f"colenhance {colenhance}",
+        "fit  y",
+    ]
+
+    ## adjustment keywords, e.g. {"rwdadjust p": 1.01244, "gadjust 40 90": 1.08918}
+    for keyword, value in parameters.items():
+        if keyword in ("ldmodel", "colenhance"):
+            continue
+        lines.append(f"{keyword} {value:.5f}")
+
+    return "\n".join(lines) + "\n"
+
+
+def write_energy_file(energy_file, energies):
+    ## incident energies for "energy <file>", one per line (MeV)
+    with open(energy_file, "w") as f:
+        for energy in energies:
+            f.write(f"{energy:.5f}\n")
 
 
 def create_talys_inp(input_file, inputs, energy_range, parameters):
     if not inputs:
         return
     else:
-        projectile = inputs.get("projectile")
-        element = inputs.get("element")
-        mass = inputs.get("mass")
-
-        ldmodel = parameters.get("ldmodel")
-        colenhance = parameters.get("colenhance")
-
         with open(input_file, "w") as f:
-            f.write("#\n")
-            f.write(f"#  {projectile}-{element}\n")
-            f.write("#\n")
-            f.write("# General\n")
-            f.write("#\n")
-            f.write(f"projectile {projectile}\n")
-            f.write(f"element {element}\n")
-            f.write(f"mass {mass}\n")
-            f.write(f"energy {energy_range}\n")
-            f.write("#\n")
-            f.write("# Parameters\n")
-            f.write("#\n")
-            f.write(f"ldmodel {ldmodel}\n")
-            f.write(f"colenhance {colenhance}\n")
-            f.write("fit  y\n")
+            f.write(talys_input_text(inputs, energy_range, parameters))
 
         print(f"File '{input_file}' created successfully!")
 
 
-def run_talys(input_file, calc_directory):
-    
-    p = Popen([os.path.join(TALYS_PATH, "bin/talys")], 
+def run_talys(
+    input_file, calc_directory, timeout=None, cancel=None, usage=None, talys_path=None
+):
+    ## timeout: seconds before the run is killed and TimeoutExpired is raised
+    ## cancel: threading.Event, the run is killed and None returned once set
+    ## usage: dict, receives the process "pid" and the peak resident memory
+    ##        "peak_rss" in MB
+    ## talys_path: TALYS installation other than TALYS_PATH
+    p = Popen([os.path.join(talys_path or TALYS_PATH, "bin/talys")], 
             cwd = calc_directory,  
             stdin=open(input_file),
             stdout=PIPE,
             stderr=PIPE)
-    
-    stdout, stderr = p.communicate()
+    if usage is not None:
+        usage["pid"] = p.pid
+
+    start = time.time()
+    timed_out = False
+    while True:
+        try:
+            stdout, stderr = p.communicate(timeout=WATCHDOG_POLL_INTERVAL)
+            break
+        except TimeoutExpired:
+            if usage is not None:
+                rss = peak_rss(p.pid)
+                if rss is not None:
+                    usage["peak_rss"] = max(rss, usage.get("peak_rss", 0.0))
+            if cancel is not None and cancel.is_set():
+                p.kill()
+                p.communicate()
+                return None
+            if timeout is not None and time.time() - start - paused_time(usage) > timeout:
+                p.kill()
+                timed_out = True
     
     with open(os.path.join(calc_directory, 'output.txt'), 'w') as outfile: 
         outfile.write(stderr.decode("utf-8"))
         outfile.write(stdout.decode("utf-8"))
+        if timed_out:
+            outfile.write(f"\nTALYS killed after {timeout:.0f} s\n")
+
+    if timed_out:
+        raise TimeoutExpired(p.args, timeout)
+
+    return p.returncode
+
+
+def paused_time(usage):
+    ## seconds the process was stopped by the scheduler (SIGSTOP)
+    if usage is None:
+        return 0.0
+    paused = usage.get("paused", 0.0)
+    if "paused_at" in usage:
+        paused += time.time() - usage["paused_at"]
+    return paused
+
+
+def peak_rss(pid):
+    ## high-water mark of the resident memory in MB; without /proc (macOS)
+    ## the current resident memory from ps, None if neither is available
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+
+    try:
+        ps = run(["ps", "-o", "rss=", "-p", str(pid)], capture_output=True, text=True, check=True)
+        return int(ps.stdout.split()[0]) / 1024.0
+    except (OSError, CalledProcessError, ValueError, IndexError):
+        return None
+
+
+def directory_size(directory):
+    ## MB
+    return sum(
+        entry.stat().st_size for entry in os.scandir(directory) if entry.is_file()
+    ) / 1024.0**2
+
 
-    return 
+def has_residual_output(calc_directory):
+    return bool(glob(os.path.join(calc_directory, "rp*")))
 
 
 
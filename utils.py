@@ -2,7 +2,8 @@ import os
 import re
 import json
 
-from elem import elemtoz, PARTICLES
+from elem import PARTICLES
+from nuclide import Nuclide, parse_reaction
 
 
 def open_json(file):
@@ -61,46 +62,36 @@ def clean_data_file(input_file, cleaned_file):
 
 
 def generate_residual_product_fname(residual):
-    ## Assuming the format as: "Mn052m"
-    r = split_by_number(residual)
-    z = elemtoz(r[0].capitalize()).zfill(3)
-    a = r[1].zfill(3)
-
-    if r[2]:
-        fextention = {
-            "m": "L01",
-            "n": "L02",
-            "l": "L03",
-            "g": "L00",
-        }
-        return f"{z}{a}.{fextention[ r[2] ]}"
-    else:
-        return f"{z}{a}.tot"
+    ## Assuming the format as: "Mn052m" -> "025052.L01"
+    return Nuclide(residual).product_fname
 
 
+def generate_residual_six_digit_code(residual):
+    ## e.g. "In111" -> "049111", "Mn052m" -> "025052m"
+    ## (same convention as search_residual_output)
+    return Nuclide(residual).code
 
 
 def calc_mass(reaction, mass):
-    if reaction == "pn":
-        return str(int(mass) - 1)
-    elif reaction == "ppn":
-        return str(int(mass) - 2)
-    elif reaction == "p2n":
-        return str(int(mass) - 2)
-    else:
+    ## e.g. "p2n": projectile p, outgoing two neutrons
+    projectile, outgoing = parse_reaction(reaction)
+    if projectile not in PARTICLES or not outgoing:
         return None
+    return str(
+        int(mass) + PARTICLES[projectile][0] - sum(PARTICLES[o][0] for o in outgoing)
+    )
 
 
 def calc_charge(projectile, outgoing, charge):
-    return int(charge) - PARTICLES[projectile][1]
+    ## Z of the residual, e.g. ("p", "2n", 29) -> 30 (before: charge minus the
+    ## projectile's charge, whatever the outgoing particles)
+    _, outgoing = parse_reaction(projectile + outgoing)
+    return int(charge) + PARTICLES[projectile][1] - sum(PARTICLES[o][1] for o in outgoing)
 
 
 def genenerate_six_digit_code(reaction, element, mass):
-    # assuming reaction: only "pn", "ppn", and "p2n" so far
-    z = elemtoz(element.capitalize()).zfill(3)
-    a = calc_mass(reaction, mass).zfill(3)
-
-    return f"{z}{a}"
+    ## residual of the reaction on the target, e.g. ("p2n", "cu", "063") -> "030062"
+    return Nuclide(f"{element}{mass}").residual(reaction).za_code
 
 
 
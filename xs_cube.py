@@ -0,0 +1,161 @@
+import os
+import json
+
+import numpy as np
+
+from config import CALC_PATH, XS_CUBE_FILE
+from nuclide import Nuclide
+from talys_jobs import reaction_name, residual_name
+
+
+## Residual cross sections of a whole campaign in one array of shape
+## (reaction, residual, parameter case, energy), stored as .npy and opened
+## memory-mapped. The JSON sidecar next to it holds the axis labels.
+## Missing values (no run, no rp file, outside the TALYS energy grid) are NaN.
+
+
+def cube_path():
+    return os.path.join(CALC_PATH, XS_CUBE_FILE)
+
+
+def sidecar_path(path):
+    return os.path.splitext(path)[0] + ".json"
+
+
+def residual_output_path(calc_directory, residual):
+    ## TALYS rp file, e.g. rp049111.tot or rp049110.L01
+    return os.path.join(calc_directory, Nuclide(residual).rp_filename)
+
+
+def load_residual_output(calc_directory, residual):
+    rp_file = residual_output_path(calc_directory, residual)
+    if not os.path.exists(rp_file):
+        return None
+
+    data = np.loadtxt(rp_file, comments="#", usecols=(0, 1), ndmin=2)
+    return data if len(data) else None
+
+
+def build_cross_section_cube(medical_isotope_reactions, jobs, energies, path=None):
+    path = path or cube_path()
+    energies = np.asarray(energies, dtype=float)
+
+    ## axis labels
+    reactions = []
+    residuals = {}
+    for input in medical_isotope_reactions:
+        reaction = reaction_name(input)
+        if reaction not in residuals:
+            reactions.append(reaction)
+            residuals[reaction] = []
+        if residual_name(input) not in residuals[reaction]:
+            residuals[reaction].append(residual_name(input))
+
+    cases = {}
+    for job in jobs:
+        cases[job["case"]] = job["parameters"]
+    n_cases = max(cases) + 1 if cases else 0
+
+    shape = (
+        len(reactions),
+        max((len(r) for r in residuals.values()), default=0),
+        n_cases,
+        len(energies),
+    )
+    cube = np.lib.format.open_memmap(path, mode="w+", dtype=np.float64, shape=shape)
+    cube[:] = np.nan
+
+    metadata = {
+        "reactions": reactions,
+        "residuals": residuals,
+        "cases": [cases.get(k) for k in range(n_cases)],
+        "energies": energies.tolist(),
+    }
+    fill_cross_section_cube(cube, metadata, jobs)
+
+    with open(sidecar_path(path), "w") as f:
+        json.dump(metadata, f, indent=1)
+
+    print(f"Cross section cube {shape} written to {path}")
+    return cube, metadata
+
+
+def fill_cross_section_cube(cube, metadata, jobs):
+    energies = np.asarray(metadata["energies"])
+
+    for job in jobs:
+        reaction = reaction_name(job["input"])
+        if reaction not in metadata["residuals"] or job["case"] >= cube.shape[2]:
+            continue
+        i = metadata["reactions"].index(reaction)
+
+        cube[i, :, job["case"], :] = np.nan
+        for j, residual in enumerate(metadata["residuals"][reaction]):
+            data = load_residual_output(job["calc_directory"], residual)
+            if data is None:
+                print(f"No TALYS output for {residual} in {job['calc_directory']}")
+                continue
+            cube[i, j, job["case"], :] = np.interp(
+                energies, data[:, 0], data[:, 1], left=np.nan, right=np.nan
+            )
+
+    cube.flush()
+
+
+def update_cross_section_cube(jobs, path=None):
+    ## rewrite only the slices of the given runs in an existing cube
+    path = path or cube_path()
+    cube = np.load(path, mmap_mode="r+")
+    with open(sidecar_path(path)) as f:
+        metadata = json.load(f)
+
+    fill_cross_section_cube(cube, metadata, jobs)
+    return cube, metadata
+
+
+def open_cross_section_cube(path=None):
+    path = path or cube_path()
+    cube = np.load(path, mmap_mode="r")
+    with open(sidecar_path(path)) as f:
+        metadata = json.load(f)
+
+    return cube, metadata
+
+
+def cube_index(metadata, reaction, residual=None):
+    i = metadata["reactions"].index(reaction)
+    if residual is None:
+        return i
+    return i, metadata["residuals"][reaction].index(residual)
+
+
+def cube_simulation_data(cube, metadata, reaction, residual, case):
+    ## same layout as load_simulation_data: columns energy, cross section
+    i, j = cube_index(metadata, reaction, residual)
+    cross_sections = np.asarray(cube[i, j, case, :])
+    energies = np.asarray(metadata["energies"])
+    valid = ~np.isnan(cross_sections)
+
+    return np.column_stack((energies[valid], cross_sections[valid]))
+
+
+def cube_slice(cube, metadata, reaction, residual, case):
+    ## cube_simulation_data, None if the run is not in the cube or has no output
+    if residual not in metadata["residuals"].get(reaction, []) or case >= cube.shape[2]:
+        return None
+    data = cube_simulation_data(cube, metadata, reaction, residual, case)
+    return data if len(data) else None
+
+
+def cube_at_energy(cube, metadata, energy):
+    ## (reaction, residual, case) cross sections linearly interpolated at energy
+    energies = np.asarray(metadata["energies"])
+    k = int(np.searchsorted(energies, energy))
+
+    if k < len(energies) and energies[k] == energy:
+        return np.asarray(cube[..., k])
+    if k == 0 or k == len(energies):
+        return np.full(cube.shape[:3], np.nan)
+
+    w = (energy - energies[k - 1]) / (energies[k] - energies[k - 1])
+    return (1.0 - w) * cube[..., k - 1] + w * cube[..., k]